@@ -21,6 +21,11 @@ import scipy
 # the Naidu model comes in fits format. sorry!
 from astropy.io import fits
 
+# the particle cache reader lives with 'make particle cache.py' in How-To/Utilities
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','..','Utilities'))
+from particlecache import readParticleCache
+
 
 
 def return_density(logr,weights=1.,rangevals=[-2, 6],bins=500,d2=False):
@@ -256,16 +261,61 @@ def twopower_density_withrolloff(r,a,alpha,beta,rcen,wcen):
 
 
 
+def accumulate_bases(bases,mass,pos,time=0.0,center=None,chunksize=1000000):
+    """make coefficients for several bases from a single pass through the particles
+
+    each chunk of particles is read and centred once, and then handed to every basis.
+    this is useful for comparing basis truncations or model files on the same snapshot.
+
+    inputs
+    ---------
+    bases       : (dict) {name: basis} for the bases to accumulate
+    mass        : (array) particle masses
+    pos         : (list of arrays) the x, y, z positions
+    time        : (float) the time to assign to the coefficients
+    center      : (three value list) the expansion center, subtracted from the positions. if None, the origin
+    chunksize   : (int) the number of particles per chunk
+
+    returns
+    ---------
+    coefs       : (dict) {name: coefficient structure} for each basis
+
+    """
+    if center is None: center = [0.,0.,0.]
+
+    for name in bases:
+        bases[name].initFromArray()
+
+    for beg in range(0,len(mass),chunksize):
+        end = min(beg+chunksize,len(mass))
+        m = np.asarray(mass[beg:end],dtype=np.float64)
+        p = [np.asarray(pos[i][beg:end],dtype=np.float64) - center[i] for i in range(3)]
+        for name in bases:
+            bases[name].addFromArray(m,p)
+
+    return {name: bases[name].makeFromArray(time=time) for name in bases}
+
+
 # read in the data
 fits_image_filename = 'GSEz0snapshot.fits'
-hdul = fits.open(fits_image_filename)
 
-# all we really care about from this is hdul[1].data['X'],hdul[1].data['Y'],hdul[1].data['Z']
+# parsing the fits file is slow. if you make a particle cache once with
+#   python3 'make particle cache.py' -t fits -o GSEz0snapshot.pcache GSEz0snapshot.fits
+# later runs memory map the columns instead, which takes no time at all.
+particle_cache = 'GSEz0snapshot.pcache'
+
+if os.path.exists(particle_cache):
+    mass,(xpos,ypos,zpos),header = readParticleCache(particle_cache)
+else:
+    hdul = fits.open(fits_image_filename)
+
+    # all we really care about from this is hdul[1].data['X'],hdul[1].data['Y'],hdul[1].data['Z']
+    xpos = hdul[1].data['X']
+    ypos = hdul[1].data['Y']
+    zpos = hdul[1].data['Z']
+    mass = np.ones(xpos.size)
+
 # compute 3d radius
-xpos = hdul[1].data['X']
-ypos = hdul[1].data['Y']
-zpos = hdul[1].data['Z']
-mass = np.ones(xpos.size)
 Rgse = np.sqrt((xpos)**2.+(ypos)**2.+((zpos)**2.))
 print(np.nanmin(Rgse),np.nanmax(Rgse))
 
@@ -274,11 +324,11 @@ rbins,dreturn = return_density(np.log10(Rgse),1.,rangevals=[0., 2.],bins=100)
 
 # for both models below, if you want to save the file, simply uncomment the pfile instance.
 # call the empirical model maker
-R,D,M,P = makemodel_empirical(rbins,dreturn),pfile='GSEbasis_empirical.txt')
+R,D,M,P = makemodel_empirical(rbins,dreturn,pfile='GSEbasis_empirical.txt')
 
 # sometimes, analytic bases are better. give this a shot?
 # this is a reasonable fit (by eye) to the GSE density
-R,D,M,P = makemodel(twopower_density_withrolloff,60000.,[20.,0,5,1.5,1.5],rvals = 10.**np.linspace(0.,2.,2000)),pfile='SLGSEfit_norm1.dat')
+R,D,M,P = makemodel(twopower_density_withrolloff,60000.,[20.,0,5,1.5,1.5],rvals = 10.**np.linspace(0.,2.,2000),pfile='SLGSEfit_norm1.dat')
 
 
 # note that to run the steps below, you do need to print the bases above.
@@ -318,8 +368,11 @@ gseA_basis = pyEXP.basis.Basis.factory(gseA_config)
 EB = gseE_basis.getBasis()
 AB = gseA_basis.getBasis()
 
-# make the coefficients for the analytic basis
-gseA_coef = gseA_basis.createFromArray(mass,[xpos,ypos,zpos], time=0.0)
+# make the coefficients for both bases in one pass through the particles.
+# add more candidate bases to the dictionary to compare them on the same snapshot.
+gse_coefs = accumulate_bases({'analytic':gseA_basis,'empirical':gseE_basis},mass,[xpos,ypos,zpos],time=0.0)
+gseA_coef = gse_coefs['analytic']
+gseE_coef = gse_coefs['empirical']
 
 # a very dirty convergence check: does the magnitude of the coefficients decrease with (l,n)?
 plt.imshow(np.abs(gseA_coef.getCoefs().real))
@@ -327,7 +380,6 @@ plt.xlabel('radial orders')
 plt.xlabel('harmonic orders')
 
 # the same, but for the empirical basis
-gseE_coef = gseE_basis.createFromArray(mass,[xpos,ypos,zpos], time=0.0)
 plt.imshow(np.abs(gseE_coef.getCoefs().real))
 plt.xlabel('radial orders')
 plt.xlabel('harmonic orders')
@@ -0,0 +1,83 @@
+import os
+import sys
+import time                     # Used for timing the estimators
+import numpy as np
+import pyEXP
+
+from os.path import exists
+from centering import densityCenter, shrinkingSphere
+
+# The Gadget reader is shared with the other array recipes and lives
+# with the particle cache in How-To/Utilities
+#
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', '..', 'Utilities'))
+from particlecache import readGadget
+
+#
+# Compare the center estimators in 'centering.py' with
+# 'pyEXP.util.getDensityCenter' on the snapshots used by
+# 'Gadget/make coefficients using MPI.py'.  For each snapshot we print
+# the wall clock time of each estimator and its distance from the
+# getDensityCenter result.  Use this to pick the faster estimator that
+# is still accurate enough for your type of simulation.
+#
+# The array estimators use every core for the neighbour queries, so
+# set OMP_NUM_THREADS to the same number of cores for a fair
+# comparison with pyEXP.
+#
+
+if __name__ == "__main__":
+
+    # Parameters
+    #
+    prefix   = 'snapshot_{:04d}.hdf5'
+    compname = 'Halo'
+    ptype    = 1                    # The Gadget particle type for compname
+    snaps    = [0, 100, 200, 300]
+    nskip    = 20
+    Nsort    = 1000
+
+    # Now switch the working directory where my simulation lives.
+    # Change this to your working directory.
+    #
+    os.chdir('/media/weinberg/Simulation data/Nbody/Sphere/RunG')
+
+    print('{:22s} {:>14s} {:>10s} {:>12s}'.format('snapshot', 'estimator', 'seconds', 'offset'))
+
+    total = {}
+
+    for i in snaps:
+        snapfile = prefix.format(i)
+        if not exists(snapfile): continue
+
+        # The reference: pyEXP reads and samples the snapshot itself
+        #
+        startTime = time.time()
+        reader = pyEXP.read.ParticleReader.createReader('GadgetHDF5', [snapfile], 0, False)
+        reader.SelectType(compname)
+        ref = np.array(pyEXP.util.getDensityCenter(reader, stride=nskip, Nsort=Nsort))
+        results = {'getDensityCenter': (time.time() - startTime, ref)}
+
+        # The array estimators, including the read
+        #
+        startTime = time.time()
+        t, pos, mass = readGadget(snapfile, ptype)
+        readTime = time.time() - startTime
+
+        startTime = time.time()
+        center = densityCenter(pos, mass, stride=nskip, Nsort=Nsort, workers=-1)
+        results['kNN density'] = (readTime + time.time() - startTime, center)
+
+        startTime = time.time()
+        center = shrinkingSphere(pos, mass, stride=nskip, workers=-1)
+        results['shrinking'] = (readTime + time.time() - startTime, center)
+
+        for name, (seconds, center) in results.items():
+            print('{:22s} {:>14s} {:10.3f} {:12.4e}'.
+                  format(snapfile, name, seconds, np.linalg.norm(center - ref)))
+            total[name] = total.get(name, 0.0) + seconds
+
+    print('\nTotal time for each estimator')
+    for name, seconds in total.items():
+        print('{:>16s} {:10.3f}'.format(name, seconds))
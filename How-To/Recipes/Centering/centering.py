@@ -0,0 +1,152 @@
+"""
+Expansion center estimators that work on particle arrays
+
+'pyEXP.util.getDensityCenter' works on a particle reader and samples
+the whole component for every snapshot.  The routines here take the
+same kind of arrays that you would pass to 'createFromArray' (e.g. from
+h5py, pygadgetreader or a FITS table), so they can be used with any
+snapshot format.  Import this file from a script in this directory:
+
+   from centering import densityCenter, shrinkingSphere, trackCenter
+
+   center = densityCenter(pos, mass, stride=20, Nsort=1000)
+   center = shrinkingSphere(pos, mass, stride=20, workers=-1)
+   for snap in snapshots:
+       pos, mass = ...
+       center, ok = trackCenter(pos, mass, center, radius=2.0, stride=20)
+
+Positions may be (N, 3) arrays or (3, N) arrays or [x, y, z] lists as
+for 'createFromArray'.  SciPy is needed for the KD tree.
+"""
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+def knnDensity(tree, mass, points, k=32, workers=1):
+    """Mass density at each point from its k nearest neighbours
+
+    tree    : cKDTree over the particles
+    mass    : the particle masses in tree order
+    points  : (M, 3) array of points at which to evaluate the density
+    k       : the number of neighbours
+    workers : the number of threads for the query (-1 uses all cores)
+    """
+    k = min(k, tree.n)
+    dist, indx = tree.query(points, k=k, workers=workers)
+    if k == 1:
+        dist, indx = dist[:,None], indx[:,None]
+    r = np.maximum(dist[:,-1], np.finfo(float).tiny)
+    return mass[indx].sum(axis=1)/(4.0*np.pi/3.0*r**3)
+
+
+def weightedCenter(pos, dens, Nsort=1000):
+    """Density weighted mean position of the Nsort densest points"""
+    Nsort = min(Nsort, len(dens))
+    top = np.argpartition(dens, len(dens) - Nsort)[-Nsort:]
+    return np.average(pos[top], axis=0, weights=dens[top])
+
+
+def asRows(pos):
+    """Positions as an (N, 3) array from (N, 3) or (3, N) input"""
+    pos = np.asarray(pos)
+    if pos.ndim == 2 and pos.shape[1] == 3:
+        return pos
+    if pos.ndim == 2 and pos.shape[0] == 3:
+        return pos.T
+    raise ValueError('centering: positions must be (N, 3) or (3, N), not {}'.
+                     format(pos.shape))
+
+
+def strideSample(pos, mass, stride):
+    """Every stride'th particle; mass may be a scalar for equal masses"""
+    pos = asRows(pos)[::stride]
+    if np.ndim(mass)==0:
+        mass = np.full(len(pos), float(mass))
+    else:
+        mass = np.asarray(mass)[::stride]
+    return pos, mass
+
+
+def densityCenter(pos, mass, stride=20, Nsort=1000, k=32, workers=1):
+    """Global density center from every stride'th particle
+
+    This follows 'pyEXP.util.getDensityCenter': estimate the density
+    at each sampled particle from its neighbours and return the
+    density weighted mean position of the Nsort densest ones.
+    """
+    pos, mass = strideSample(pos, mass, stride)
+    dens = knnDensity(cKDTree(pos), mass, pos, k, workers)
+    return weightedCenter(pos, dens, Nsort)
+
+
+def trackCenter(pos, mass, prev, radius, stride=20, Nsort=1000, k=32,
+                minpart=None, maxshift=0.5, workers=1):
+    """Density center found near the center of the previous snapshot
+
+    A KD tree over the strided sample is used to pick out the
+    particles inside 'radius' of the previous center, and only those
+    are used for the density estimate.  The track is lost when there
+    are fewer than 'minpart' particles in the sphere (default: 2*Nsort)
+    or the new center moved by more than maxshift*radius; we then fall
+    back to the global estimate.  Use prev=None to start a track.
+
+    Returns the center and True if the track was kept, False if the
+    global estimate was used.
+    """
+    if minpart is None: minpart = 2*Nsort
+
+    pos, mass = strideSample(pos, mass, stride)
+    tree = cKDTree(pos)
+
+    if prev is not None:
+        prev = np.asarray(prev, dtype=float)
+        core = np.asarray(tree.query_ball_point(prev, radius, workers=workers),
+                          dtype=int)
+
+        if len(core) >= minpart:
+            # The density of the core particles only needs their own
+            # neighbours, so a second small tree does the work
+            #
+            cpos  = pos[core]
+            cmass = mass[core]
+            dens  = knnDensity(cKDTree(cpos), cmass, cpos, k, workers)
+            center = weightedCenter(cpos, dens, Nsort)
+            if np.linalg.norm(center - prev) <= maxshift*radius:
+                return center, True
+
+    dens = knnDensity(tree, mass, pos, k, workers)
+    return weightedCenter(pos, dens, Nsort), False
+
+
+def shrinkingSphere(pos, mass, stride=20, k=32, shrink=0.8, nmin=1000,
+                    rinit=None, workers=-1):
+    """Density center by iterative shrinking-sphere refinement
+
+    The start is the density weighted mean of the whole strided sample
+    and the starting radius is 'rinit' (default: the radius that holds
+    90% of the sample).  At each step the radius is reduced by the
+    factor 'shrink' and the center is recomputed as the density
+    weighted mean of the particles inside the sphere, until fewer than
+    'nmin' particles are left.  Weighting by the k nearest neighbour
+    density rather than the mass makes the result less sensitive to
+    the outer particles of the sphere.  The neighbour queries run on
+    'workers' threads (-1 uses all cores).
+    """
+    pos, mass = strideSample(pos, mass, stride)
+    tree = cKDTree(pos)
+    dens = knnDensity(tree, mass, pos, k, workers)
+
+    center = np.average(pos, axis=0, weights=dens)
+    if rinit is None:
+        rinit = np.quantile(np.linalg.norm(pos - center, axis=1), 0.9)
+
+    radius = rinit
+    while True:
+        inside = tree.query_ball_point(center, radius, workers=workers)
+        if len(inside) < nmin: break
+        inside = np.asarray(inside, dtype=int)
+        center = np.average(pos[inside], axis=0, weights=dens[inside])
+        radius *= shrink
+
+    return center
@@ -0,0 +1,81 @@
+import os
+import sys
+import time                     # Used for timing the center search
+import numpy as np
+
+from os.path import exists
+from centering import trackCenter
+
+# The Gadget reader is shared with the other array recipes and lives
+# with the particle cache in How-To/Utilities
+#
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', '..', 'Utilities'))
+from particlecache import readGadget
+
+#
+# Follow the density center of one component through a Gadget HDF5
+# snapshot sequence.  The first snapshot gets a global estimate, and
+# after that the search starts from the previous center and only looks
+# at the particles inside 'radius'.  The cost per snapshot then goes
+# with the number of particles in the core rather than the total.  If
+# the track is lost (too few particles in the sphere or a large jump)
+# we fall back to the global estimate for that snapshot.
+#
+# The centers are written in the same four column format as 'find
+# center (parallel).py': time, x, y, z.
+#
+
+if __name__ == "__main__":
+
+    # Parameters
+    #
+    prefix  = 'snapshot_{:04d}.hdf5'
+    ptype   = 1                     # Gadget particle type: 1 is the halo
+    beg_seq = 0
+    end_seq = 600
+    nskip   = 20                    # Use every nskip'th particle
+    Nsort   = 1000                  # Number of densest particles in the mean
+    radius  = 10.0                  # Search radius about the previous center
+    ctrfile = 'tracked.centers'
+
+    # Now switch the working directory where my simulation lives.
+    # Change this to your working directory.
+    #
+    os.chdir('/media/weinberg/Simulation data/Nbody/Sphere/RunG')
+
+    center = None
+    ntrack = 0
+    nlost  = 0
+
+    runTime = time.time()
+
+    with open(ctrfile, 'w') as out:
+
+        for i in range(beg_seq, end_seq):
+
+            snapfile = prefix.format(i)
+            if not exists(snapfile): continue
+
+            t, pos, mass = readGadget(snapfile, ptype)
+
+            startTime = time.time()
+            center, tracked = trackCenter(pos, mass, center, radius,
+                                          stride=nskip, Nsort=Nsort)
+            #                                   ^
+            #                                   |
+            # None for the first snapshot ------+ gives a global estimate
+            #
+            if tracked: ntrack += 1
+            else:       nlost  += 1
+
+            print('{} at T={:6.3f}: center={} {} in {:4.2f} seconds'.
+                  format(snapfile, t, center,
+                         'tracked' if tracked else 'global',
+                         time.time() - startTime))
+
+            line = '{:13.6e} {:13.6e} {:13.6e} {:13.6e}\n'.format(t, center[0], center[1], center[2])
+            out.write(line)
+
+    print('\nCompleted the snapshot list in {:4.2f} seconds'.format(time.time() - runTime))
+    print('{} centers were tracked and {} needed the global estimate'.format(ntrack, nlost))
@@ -13,6 +13,7 @@ note: this version now uses pygadgetreader. there is a native EXP reader as well
 
 import os
 import pyEXP
+import numpy as np
 import matplotlib.pyplot as plt
 
 import pygadgetreader
@@ -27,40 +28,7 @@ basedir = '/Volumes/External1/ChervinSgrSim/'
 os.chdir(basedir)
 
 
-# this can be a list of snapshots, or you can loop through one at a time. For now, I'm just practicing on the first snapshot.
-group = ['snap_001']
-
-# if you have pygadgetreader, you can use that for a smaller memory footprint:
-# https://github.com/jveitchmichaelis/pygadgetreader
-
-# The component names are: ['bndry'=Sgr stars (Hernquist), 'bulge'=MW bulge, 'disk'=MW disk, 'dm'=MW halo, 'star'=DM halo of Sgr]
-P = pygadgetreader.readsnap(group[0],'pos','dm')
-# rotate/align/centre the positions here...
-
-M = pygadgetreader.readsnap(group[0],'mass','dm')
-t = pygadgetreader.readheader(group[0],'time')
-
-# read in the actual data, using the full EXP capabilities
-#reader = pyEXP.read.ParticleReader.createReader('GadgetNative', group, 0, True); # this will take a tens of seconds.
-#print('The component names are:', reader.GetTypes())
-# The component names are: ['Bndry'=Sgr stars (Hernquist), 'Bulge'=MW bulge, 'Disk'=MW disk, 'Halo'=MW halo, 'Stars'=DM halo of Sgr]
-# We currently only care about the MW halo, bulge, and disk. We'll expand them below.
-
-# the first step is to find the center of the simulation. Let's assume that is the halo centre for now. We will use this centre for all components.
-#compname = 'Halo'
-#reader.SelectType(compname) # this will take a few seconds.
-#nskip = 50 # this needs to be a relatively small number to get a good centre. We might be able to get away with a little larger (if gadget sims are in kpc)
-#center = pyEXP.util.getDensityCenter(reader, nskip) # this will take tens of seconds.
-
-# we do need to record the center at each timestep for later translation, so let's open a file and print
-# only open the file and print the header at the first timestep!
-centerfile = open('simulationcenters.txt','w')
-print('{:13s} {:13s} {:13s} {:13s}'.format('time','xcentre','ycentre','zcentre'),file=centerfile)
-
-# print to the file
-print('{:13.6e} {:13.6e} {:13.6e} {:13.6e}'.format(reader.CurrentTime(), center[0], center[1], center[2]),file=centerfile)
-
-# now, let's generate a basis for the halo. These are the settings, no need to touch these for now.
+# the bases for the halo, bulge and disc. These are the settings, no need to touch these for now.
 halo_config = """
 id         : sphereSL
 parameters :
@@ -73,37 +41,8 @@ parameters :
   modelname : SLGrid.empirical.mw.isolated.ieee
   cachename : SLGridSph.cache.mw
 """
-
 halo_basis = pyEXP.basis.Basis.factory(halo_config)
 
-# make the coefficients
-compname = 'Halo'
-
-# this version uses the native EXP reader format.
-#reader.SelectType(compname) # this will take a few seconds.
-#halo_coef = halo_basis.createFromReader(reader, center) # this will take a few seconds
-
-# if you want to use the array creator, do this:
-halo_coef = halo_basis.createFromArray(M,P, time=t)
-
-# make a makecoefs instance
-# only do this at the first step: afterwords just add (see below).
-halo_coefs = pyEXP.coefs.Coefs.makecoefs(halo_coef, compname)
-
-# add the coefficients to the makecoefs instance
-halo_coefs.add(halo_coef)
-
-# write the first step (afterwards use ExtendH5Coefs)
-halo_coefs.WriteH5Coefs('outcoef.mwhalo.L18')
-
-# normally, we would go back and re-read a new file, make new coefficients, etc, but in this case we are just practicing with a single snapshot.
-# so we'll adjust the time manually, add the coefficients again, and extend the written coefficient file
-halo_coef.time = 1000.0
-halo_coefs.add(halo_coef)
-halo_coefs.ExtendH5Coefs('outcoef.mwhalo.L18')
-
-# same procedure as above, but now for the bulge
-# now, let's generate a basis for the bulge
 bulge_config = """
 id         : sphereSL
 parameters :
@@ -118,32 +57,7 @@ parameters :
 """
 bulge_basis = pyEXP.basis.Basis.factory(bulge_config)
 
-# generate the coefficients
-compname = 'Bulge'
-#reader.SelectType(compname) # this will take a few seconds.
-#bulge_coef = bulge_basis.createFromReader(reader, center) # this will take a few seconds
-
-P = pygadgetreader.readsnap(group[0],'pos','bulge')
-# rotate/align/centre the positions here...
-
-M = pygadgetreader.readsnap(group[0],'mass','bulge')
-t = pygadgetreader.readheader(group[0],'time')
-
-bulge_coef = bulge_basis.createFromArray(M,P, time=t)
-
-
-# make a makecoefs instance
-# only do this at the first step: afterwords just add (see below).
-bulge_coefs = pyEXP.coefs.Coefs.makecoefs(bulge_coef, compname)
-bulge_coefs.add(bulge_coef)
-bulge_coefs.WriteH5Coefs('outcoef.mwbulge.L18')
-
-# do the false duplication for extra time
-bulge_coef.time = 1000.0
-bulge_coefs.add(bulge_coef)
-bulge_coefs.ExtendH5Coefs('outcoef.mwbulge.L18')
-
-# now, the disc. The configuration looks different, but the process is exactly the same.
+# the disc configuration looks different, but the process is exactly the same.
 disk_config = """
 id         : cylinder
 parameters :
@@ -164,29 +78,106 @@ parameters :
 """
 disk_basis = pyEXP.basis.Basis.factory(disk_config)
 
-compname = 'Disk'
-#reader.SelectType(compname) # this will take a few seconds.
-#disk_coef = disk_basis.createFromReader(reader, center) # this will take a few seconds
 
-P = pygadgetreader.readsnap(group[0],'pos','disk')
-# rotate/align/centre the positions here...
+# The component names are: ['bndry'=Sgr stars (Hernquist), 'bulge'=MW bulge, 'disk'=MW disk, 'dm'=MW halo, 'star'=DM halo of Sgr]
+# and the gadget particle types are gas=0, dm=1, disk=2, bulge=3, star=4, bndry=5.
+# We currently only care about the MW halo, bulge, and disk.
+# each entry is {component name: (gadget particle type, basis)}
+components = {'Halo':  (1, halo_basis),
+              'Bulge': (3, bulge_basis),
+              'Disk':  (2, disk_basis)}
+
+
+def make_component_coefs(snapshots, components, coefs=None, center=None):
+    """make coefficients for several components, reading each snapshot only once
+
+    inputs
+    -------------
+    snapshots   : (list of strings) the gadget snapshot files, in time order
+    components  : (dict) {component name: (gadget particle type, basis)}
+    coefs       : (dict) {component name: Coefs} to append to. If None, new containers are made
+    center      : (list of floats) the expansion center, subtracted from all positions. If None, the origin
+
+    outputs
+    -------------
+    coefs       : (dict) {component name: Coefs}, one coefficient container per component
+
+    """
+    if coefs is None: coefs = dict()
+
+    for snap in snapshots:
+
+        # read the positions and masses of all particle types at once (ptype=-1).
+        # the types come back in order, so the header particle counts give the slices.
+        P = pygadgetreader.readsnap(snap,'pos',-1)
+        M = pygadgetreader.readsnap(snap,'mass',-1)
+        t = pygadgetreader.readheader(snap,'time')
+        N = pygadgetreader.readheader(snap,'npartTotal')
+        offset = np.concatenate([[0],np.cumsum(N)])
 
-M = pygadgetreader.readsnap(group[0],'mass','disk')
-t = pygadgetreader.readheader(group[0],'time')
+        # rotate/align/centre the positions here...
+        if center is not None: P = P - np.array(center)
 
-disk_coef = disk_basis.createFromArray(M,P, time=t)
+        def make_one(name):
+            ptype,basis = components[name]
+            beg,end = offset[ptype],offset[ptype+1]
+            return basis.createFromArray(M[beg:end],P[beg:end], time=t)
 
+        made = {name: make_one(name) for name in components}
 
-# make a makecoefs instance
-# only do this at the first step: afterwords just add (see below).
-disk_coefs = pyEXP.coefs.Coefs.makecoefs(disk_coef, compname)
-disk_coefs.add(disk_coef)
-disk_coefs.WriteH5Coefs('outcoef.mwdisk.L18')
+        # only make a makecoefs instance at the first step: afterwards just add.
+        for name in components:
+            if name not in coefs:
+                coefs[name] = pyEXP.coefs.Coefs.makecoefs(made[name], name)
+            coefs[name].add(made[name])
 
-# do the false duplication for extra time
-disk_coef.time = 1000.0
-disk_coefs.add(disk_coef)
-disk_coefs.ExtendH5Coefs('outcoef.mwdisk.L18')
+    return coefs
+
+
+# this can be a list of snapshots, or you can loop through one at a time. For now, I'm just practicing on the first snapshot.
+group = ['snap_001']
+
+# if you have pygadgetreader, you can use that for a smaller memory footprint:
+# https://github.com/jveitchmichaelis/pygadgetreader
+
+# read in the actual data, using the full EXP capabilities
+#reader = pyEXP.read.ParticleReader.createReader('GadgetNative', group, 0, True); # this will take a tens of seconds.
+#print('The component names are:', reader.GetTypes())
+# The component names are: ['Bndry'=Sgr stars (Hernquist), 'Bulge'=MW bulge, 'Disk'=MW disk, 'Halo'=MW halo, 'Stars'=DM halo of Sgr]
+
+# the first step is to find the center of the simulation. Let's assume that is the halo centre for now. We will use this centre for all components.
+#compname = 'Halo'
+#reader.SelectType(compname) # this will take a few seconds.
+#nskip = 50 # this needs to be a relatively small number to get a good centre. We might be able to get away with a little larger (if gadget sims are in kpc)
+#center = pyEXP.util.getDensityCenter(reader, nskip) # this will take tens of seconds.
+# the native reader has also read every particle type at once, so you could make each component with
+#reader.SelectType(compname) # this will take a few seconds.
+#halo_coef = halo_basis.createFromReader(reader, center) # this will take a few seconds
+center = [0.,0.,0.]
+
+# we do need to record the center at each timestep for later translation, so let's open a file and print
+# only open the file and print the header at the first timestep!
+centerfile = open('simulationcenters.txt','w')
+print('{:13s} {:13s} {:13s} {:13s}'.format('time','xcentre','ycentre','zcentre'),file=centerfile)
+
+# print to the file
+print('{:13.6e} {:13.6e} {:13.6e} {:13.6e}'.format(pygadgetreader.readheader(group[0],'time'), center[0], center[1], center[2]),file=centerfile)
+
+# make the coefficients for all three components from a single read of each snapshot.
+coefs = make_component_coefs(group, components, center=center)
+
+# write the first step (afterwards use ExtendH5Coefs)
+cfiles = {'Halo': 'outcoef.mwhalo.L18', 'Bulge': 'outcoef.mwbulge.L18', 'Disk': 'outcoef.mwdisk.L18'}
+for name in cfiles:
+    coefs[name].WriteH5Coefs(cfiles[name])
+
+# normally, we would go back and re-read a new file, make new coefficients, etc, but in this case we are just practicing with a single snapshot.
+# so we'll adjust the time manually, add the coefficients again, and extend the written coefficient file
+for name in cfiles:
+    coef = coefs[name].getCoefStruct(coefs[name].Times()[0]).deepcopy()
+    coef.time = 1000.0
+    coefs[name].add(coef)
+    coefs[name].ExtendH5Coefs(cfiles[name])
 
 
 
@@ -0,0 +1,342 @@
+"""
+An HDF5 store for histogram image stacks
+
+The histogram recipes in this directory used to keep every image and
+profile in a dictionary and pickle the lot at the end of the run.  An
+ImageStore appends each snapshot to an HDF5 file as it is made:
+
+   /time             (T,)          snapshot times
+   /image/xy         (T, nx, ny)   one dataset per projection
+   /image/xz, ...
+   /histo            (T, ...)      the radial profiles
+
+The datasets are chunked by time and compressed, so a reader can pull
+out a single frame or a range of times without reading the rest, and a
+run that dies keeps everything made so far.  An image is indexed [i, j]
+by the first and second coordinate of its projection, as for
+'FieldGenerator.histo2d'.  The histogram 'lower', 'upper' and 'ngrid'
+lists are attributes of the file.
+
+   with ImageStore('imageStore.h5', lower, upper, ngrid) as store:
+       store.append(time, fg.histo2d(reader), fg.histo1d(reader, rmax, nbin, "xy"))
+
+   store = ImageStore('imageStore.h5', mode='r')
+   frame = store.image('xy', 10)
+
+Frames are numbered in the order they were appended, and the number
+of a frame never changes.  A sorted time index gives the frame nearest
+to a time or the frames in a time range without a scan:
+
+   i     = store.nearest(2.37)
+   ids   = store.frames(2.0, 3.0)          # 2 <= t < 3
+   stack = store.images('xy', 2.0, 3.0)
+
+For particles that are already in memory as arrays (e.g. from h5py,
+pygadgetreader or a FITS table) the HistogramEngine makes the same
+images and profile without a particle reader:
+
+   engine = HistogramEngine(lower, upper, ngrid, rmax, nbin)
+   engine.add(mass, pos)
+   store.append(time, engine.images(), engine.histo())
+
+With 'moments=True' and velocities passed to 'add', the engine also
+makes mean velocity and dispersion images in the same pass.
+"""
+
+import h5py
+import numpy as np
+
+
+class ImageStore:
+    """Append-per-snapshot HDF5 store of histogram images and profiles"""
+
+    def __init__(self, filename, lower=None, upper=None, ngrid=None,
+                 mode='a', compression='gzip', level=4):
+        self.file = h5py.File(filename, mode)
+        self.compression = compression
+        self.level = level
+
+        if 'time' not in self.file:
+            if mode == 'r':
+                raise ValueError('ImageStore: <{}> is not an image store'.format(filename))
+            self.file.attrs['lower'] = lower
+            self.file.attrs['upper'] = upper
+            self.file.attrs['ngrid'] = ngrid
+            self.file.create_dataset('time', shape=(0,), maxshape=(None,),
+                                     dtype='f8', chunks=(1024,))
+
+        self.lower = list(self.file.attrs['lower'])
+        self.upper = list(self.file.attrs['upper'])
+        self.ngrid = list(self.file.attrs['ngrid'])
+
+        if mode != 'r': self.trim()
+        self.reindex()
+
+    def trim(self):
+        """Drop frames left over from an append that did not finish
+
+        'append' writes the time last, so a frame belongs to the store
+        only once its time is on disk.  Any image or profile beyond the
+        length of the time dataset is removed.
+        """
+        n = self.file['time'].shape[0]
+        paths = ['image/' + name for name in self.projections] + ['histo']
+        for path in paths:
+            if path in self.file and self.file[path].shape[0] > n:
+                self.file[path].resize(n, axis=0)
+
+    def reindex(self):
+        """Make the sorted time index from the time dataset"""
+        times = self.file['time'][:]
+        self.order  = np.argsort(times, kind='stable')
+        self.tindex = times[self.order]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.file.close()
+
+    def __len__(self):
+        return self.file['time'].shape[0]
+
+    @property
+    def times(self):
+        """The array of snapshot times"""
+        return self.file['time'][:]
+
+    @property
+    def projections(self):
+        """The names of the image projections, e.g. ['xy', 'xz', 'yz']"""
+        return list(self.file['image'].keys()) if 'image' in self.file else []
+
+    def stack(self, name):
+        """The (T, nx, ny) dataset for a projection, read lazily"""
+        return self.file['image'][name]
+
+    def image(self, name, i):
+        """Projection 'name' for frame i"""
+        return self.file['image'][name][i]
+
+    def histo(self, i):
+        """The radial profile for frame i"""
+        return self.file['histo'][i]
+
+    def nearest(self, t):
+        """The id of the frame closest in time to t"""
+        if len(self.tindex) == 0:
+            raise ValueError('ImageStore: the store is empty')
+        k = np.searchsorted(self.tindex, t)
+        if k == len(self.tindex) or (k > 0 and t - self.tindex[k-1] <= self.tindex[k] - t):
+            k -= 1
+        return int(self.order[k])
+
+    def frames(self, tmin, tmax):
+        """The ids of the frames with tmin <= time < tmax in time order
+
+        Returns a slice when the frames are stored in time order, which
+        is the usual case, and an index array otherwise.
+        """
+        beg = np.searchsorted(self.tindex, tmin, side='left')
+        end = np.searchsorted(self.tindex, tmax, side='left')
+        ids = self.order[beg:end]
+        if len(ids) == 0:
+            return slice(0, 0)
+        if ids[-1] - ids[0] == len(ids) - 1 and np.all(np.diff(ids) == 1):
+            return slice(int(ids[0]), int(ids[-1]) + 1)
+        return ids
+
+    def images(self, name, tmin, tmax):
+        """The images of projection 'name' with tmin <= time < tmax
+
+        Only the chunks for those frames are read from the file.
+        """
+        ids = self.frames(tmin, tmax)
+        if isinstance(ids, slice):
+            return self.file['image'][name][ids]
+        return np.stack([self.file['image'][name][i] for i in ids])
+
+    def extend(self, path, data):
+        """Append one frame to a dataset, making the dataset if needed"""
+        data = np.asarray(data)
+        if path not in self.file:
+            self.file.create_dataset(path, shape=(0,) + data.shape,
+                                     maxshape=(None,) + data.shape,
+                                     chunks=(1,) + data.shape,
+                                     dtype=data.dtype, shuffle=True,
+                                     compression=self.compression,
+                                     compression_opts=self.level)
+        dset = self.file[path]
+        n = dset.shape[0]
+        dset.resize(n + 1, axis=0)
+        dset[n] = data
+
+    def append(self, time, images, histo=None):
+        """Add the images (a dictionary by projection) for one snapshot
+
+        The time is written last and the file is flushed so that the
+        frame is on disk when this returns.
+        """
+        for name, data in images.items():
+            self.extend('image/' + name, data)
+        if histo is not None:
+            self.extend('histo', histo)
+        self.extend('time', time)
+        self.file.flush()
+
+        # Keep the time index current.  Frames usually arrive in time
+        # order, so this is an append.
+        #
+        n = len(self.order)
+        k = np.searchsorted(self.tindex, time, side='right')
+        self.order  = np.insert(self.order, k, n)
+        self.tindex = np.insert(self.tindex, k, time)
+
+
+class HistogramEngine:
+    """Projected images and a radial profile from particle arrays
+
+    The xy, xz and yz images use the (lower, upper, ngrid) box of the
+    recipes and are indexed [i, j] by the first and second coordinate
+    of the projection, as for 'FieldGenerator.histo2d'.  Only
+    particles inside the box are counted.  The radial profile is in
+    the xy plane with 'nbin' bins out to 'rmax'.  Each image is the
+    mass per unit area of its pixels.
+
+    All projections and the profile are binned in one pass with
+    'np.bincount' on flat pixel indices.  Particles are handled
+    'chunksize' at a time so that the temporary index arrays stay
+    small; call 'add' as many times as you like before asking for the
+    results.
+
+    With 'moments=True', the sums of m*v and m*v^2 for the line of
+    sight velocity of each projection (vz for xy, vy for xz and vx for
+    yz) are accumulated in the same pass, and 'images' also returns
+    the mass weighted mean velocity ('xy vmean', ...) and dispersion
+    ('xy vdisp', ...) images.  Empty pixels are zero.
+    """
+
+    # The two image axes and the line of sight axis of each projection
+    #
+    projections = {'xy': (0, 1, 2), 'xz': (0, 2, 1), 'yz': (1, 2, 0)}
+
+    def __init__(self, lower, upper, ngrid, rmax, nbin, chunksize=1000000,
+                 moments=False):
+        self.lower = np.asarray(lower, dtype=float)
+        self.upper = np.asarray(upper, dtype=float)
+        self.ngrid = np.asarray(ngrid, dtype=int)
+        self.delta = (self.upper - self.lower)/self.ngrid
+        self.rmax  = rmax
+        self.nbin  = nbin
+        self.chunksize = chunksize
+        self.moments   = moments
+        self.reset()
+
+    def reset(self):
+        """Zero the accumulated sums"""
+        self.mass = {}
+        self.mv   = {}
+        self.mv2  = {}
+        for name, (a, b, c) in self.projections.items():
+            self.mass[name] = np.zeros(self.ngrid[a]*self.ngrid[b])
+            if self.moments:
+                self.mv [name] = np.zeros(self.ngrid[a]*self.ngrid[b])
+                self.mv2[name] = np.zeros(self.ngrid[a]*self.ngrid[b])
+        self.rmass = np.zeros(self.nbin)
+
+    def add(self, mass, pos, vel=None):
+        """Bin particles with positions 'pos' and masses 'mass'
+
+        'pos' (and 'vel') may be (3, N) as for 'createFromArray' or
+        (N, 3) and 'mass' may be a scalar for equal mass particles.
+        The velocities are needed if the engine was made with
+        'moments=True'.
+        """
+        pos = np.asarray(pos)
+        if pos.shape[0] != 3: pos = pos.T
+        n = pos.shape[1]
+        mass = np.broadcast_to(np.asarray(mass, dtype=float), (n,))
+
+        if self.moments:
+            if vel is None:
+                raise ValueError('HistogramEngine: moments need velocities')
+            vel = np.asarray(vel)
+            if vel.shape[0] != 3: vel = vel.T
+
+        for beg in range(0, n, self.chunksize):
+            end = min(beg + self.chunksize, n)
+            self.addChunk(mass[beg:end], pos[:,beg:end],
+                          None if vel is None else vel[:,beg:end])
+
+    def addChunk(self, mass, pos, vel=None):
+        """Bin one chunk of particles"""
+        # Cell index along each axis and the particles inside the box
+        #
+        indx = np.floor((pos - self.lower[:,None])/self.delta[:,None]).astype(np.int64)
+        good = np.all((indx >= 0) & (indx < self.ngrid[:,None]), axis=0)
+        gi   = indx[:,good]
+        gm   = mass[good]
+
+        for name, (a, b, c) in self.projections.items():
+            size = self.mass[name].size
+            flat = gi[a]*self.ngrid[b] + gi[b]
+            self.mass[name] += np.bincount(flat, weights=gm, minlength=size)
+            if self.moments:
+                mv = gm*vel[c][good]
+                self.mv [name] += np.bincount(flat, weights=mv, minlength=size)
+                self.mv2[name] += np.bincount(flat, weights=mv*vel[c][good],
+                                              minlength=size)
+
+        R = np.hypot(pos[0], pos[1])
+        ir = (R*(self.nbin/self.rmax)).astype(np.int64)
+        good = ir < self.nbin
+        self.rmass += np.bincount(ir[good], weights=mass[good], minlength=self.nbin)
+
+    def images(self):
+        """Dictionary of projected surface density and moment images"""
+        out = {}
+        for name, (a, b, c) in self.projections.items():
+            shape = (self.ngrid[a], self.ngrid[b])
+            m     = self.mass[name]
+            out[name] = (m/(self.delta[a]*self.delta[b])).reshape(shape)
+            if self.moments:
+                full  = m > 0.0
+                vmean = np.divide(self.mv [name], m, out=np.zeros_like(m), where=full)
+                v2    = np.divide(self.mv2[name], m, out=np.zeros_like(m), where=full)
+                out[name + ' vmean'] = vmean.reshape(shape)
+                out[name + ' vdisp'] = np.sqrt(np.maximum(v2 - vmean*vmean, 0.0)).reshape(shape)
+        return out
+
+    def histo(self):
+        """The radial profile as an (nbin, 2) array of radius and surface density"""
+        edges = np.linspace(0.0, self.rmax, self.nbin+1)
+        area  = np.pi*(edges[1:]**2 - edges[:-1]**2)
+        return np.column_stack([0.5*(edges[1:] + edges[:-1]), self.rmass/area])
+
+
+def mergeStores(parts, filename):
+    """Merge several stores into a new one in time order
+
+    Used by the MPI recipe, where every rank writes its own store.
+    Returns the number of frames.
+    """
+    sources = [ImageStore(p, mode='r') for p in parts]
+
+    frames = []
+    for s in sources:
+        frames.extend([(t, s, i) for i, t in enumerate(s.times)])
+    frames.sort(key=lambda x: x[0])
+
+    first = sources[0]
+    with ImageStore(filename, first.lower, first.upper, first.ngrid, mode='w') as out:
+        for t, s, i in frames:
+            images = {name: s.image(name, i) for name in s.projections}
+            histo  = s.histo(i) if 'histo' in s.file else None
+            out.append(t, images, histo)
+
+    for s in sources: s.close()
+
+    return len(frames)
@@ -0,0 +1,66 @@
+import os, sys
+import numpy as np
+
+from os.path import exists
+from histotools import ImageStore, HistogramEngine
+
+# The Gadget reader is shared with the other array recipes and lives
+# with the particle cache in How-To/Utilities
+#
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', '..', 'Utilities'))
+from particlecache import readGadget
+
+if (len(sys.argv)<2):
+    print('Usage: {} prefix [rmax] [nbin] [ptype]'.format(sys.argv[0]))
+    exit(1)
+
+rmax = 0.03
+if (len(sys.argv)>2):
+    rmax = float(sys.argv[2])
+
+nbin = 80
+if (len(sys.argv)>3):
+    nbin = int(sys.argv[3])
+
+ptype = 1
+if (len(sys.argv)>4):
+    ptype = int(sys.argv[4])
+
+#
+# Make the same image store as 'make density histograms from
+# snapshots.py' for Gadget HDF5 snapshots read into arrays rather than a
+# pyEXP particle reader.  The histograms are made by the NumPy
+# HistogramEngine in 'histotools.py', so this works for any particles
+# that you can get into arrays.  The mean velocity and dispersion
+# images are made in the same pass as the density.
+#
+
+# Make the file list for the snapshot sequence, e.g. the prefix
+# 'snapshot_' gives snapshot_0000.hdf5, snapshot_0001.hdf5, ...
+#
+beg_seq = 0
+end_seq = 10000
+
+lower = [-rmax, -rmax, -rmax]
+upper = [ rmax,  rmax,  rmax]
+ngrid = [ nbin,  nbin,  nbin]
+
+engine = HistogramEngine(lower, upper, ngrid, rmax, nbin, moments=True)
+store  = ImageStore('imageStore.h5', lower, upper, ngrid, mode='w')
+
+for i in range(beg_seq, end_seq):
+
+    snapfile = '{}{:04d}.hdf5'.format(sys.argv[1], i)
+    if not exists(snapfile): continue
+
+    time, pos, mass, vel = readGadget(snapfile, ptype, velocities=True)
+
+    engine.reset()
+    engine.add(mass, pos, vel)
+    store.append(time, engine.images(), engine.histo())
+
+keys = store.times
+print("Time[0]={}  Time[{}]={}".format(keys[0], len(keys)-1, keys[-1]))
+
+store.close()
@@ -1,9 +1,10 @@
 import os, sys
 import pyEXP
 import numpy as np
-import pickle
+import json
 
 from os.path import exists
+from histotools import ImageStore
 
 if (len(sys.argv)<2):
     print('Usage: {} runtag [rmax]'.format(sys.argv[0]))
@@ -18,27 +19,36 @@ if (len(sys.argv)>3):
     nbin = int(sys.argv[3])
 
 
-# Make the file list for the snapshot sequence
+# Use the snapshot manifest if there is one (see 'make snapshot
+# manifest.py' in How-To/Utilities).  It already knows which snapshots
+# exist, so we do not need to probe for every file name.
 #
-beg_seq = 0
-end_seq = 10000
-file_list = []
-for i in range(beg_seq, end_seq):
-    file_list.append('SPL.{}.{:05d}'.format(sys.argv[1], i))
-#                     ^
-#                     |
-#   Change this depending on your phase-space type
-
-# Construct batches of files the particle reader.  One could use the
-# parseStringList to create batches from a vector/list of files.  NB:
-# a std::vector in C++ becomes a Python.list and vice versa
-#
-batches = pyEXP.read.ParticleReader.parseStringList(file_list, '')
-xy = {}
-xz = {}
-yz = {}
+manifest = 'SPL.{}.manifest'.format(sys.argv[1])
+probe = not exists(manifest)
+
+if not probe:
+    with open(manifest, 'r') as f:
+        batches = [v['files'] for v in json.load(f)['snapshots']]
+else:
+    # Make the file list for the snapshot sequence
+    #
+    beg_seq = 0
+    end_seq = 10000
+    file_list = []
+    for i in range(beg_seq, end_seq):
+        file_list.append('SPL.{}.{:05d}'.format(sys.argv[1], i))
+    #                     ^
+    #                     |
+    #   Change this depending on your phase-space type
+
+    # Construct batches of files the particle reader.  One could use the
+    # parseStringList to create batches from a vector/list of files.  NB:
+    # a std::vector in C++ becomes a Python.list and vice versa
+    #
+    batches = pyEXP.read.ParticleReader.parseStringList(file_list, '')
 
-# For a unique map with fixed-point time as a key
+# Round the snapshot time to a fixed point so that the stored times
+# match the times in the coefficient files
 #
 def getTime(time):
     fixedD = 100000.0;
@@ -51,14 +61,17 @@ upper = [ rmax,  rmax,  rmax]
 ngrid = [ nbin,  nbin,  nbin]
 
 fg = pyEXP.field.FieldGenerator(times, lower, upper, ngrid)
-gd = {}
-rd = {}
+
+# Each snapshot is appended to the image store as soon as it is made.
+# See 'histotools.py' for the layout.
+#
+store = ImageStore('imageStore.h5', lower, upper, ngrid, mode='w')
 
 for group in batches:
 
     okay = True
     for f in group:
-        if not exists(f):
+        if probe and not exists(f):
             okay = False
         
     if not okay: continue
@@ -72,13 +85,9 @@ for group in batches:
     reader.SelectType(compname)
     
     tim = getTime(reader.CurrentTime())
-    gd[tim] = fg.histo2d(reader)
-    rd[tim] = fg.histo1d(reader, rsize, nbins, "xy")
+    store.append(tim, fg.histo2d(reader), fg.histo1d(reader, rmax, nbin, "xy"))
 
-keys =  list(gd.keys())
+keys = store.times
 print("Time[0]={}  Time[{}]={}".format(keys[0], len(keys)-1, keys[-1]))
 
-db = {'image': gd, 'histo': rd, 'lower': lower, 'upper': upper, 'ngrid': ngrid}
-file = open('imagePickle', 'wb')
-pickle.dump(db, file)
-file.close()
+store.close()
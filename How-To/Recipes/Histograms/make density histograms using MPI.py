@@ -1,11 +1,27 @@
 import os, sys
+
+# MPI is only brought up at the end, so that each rank runs pyEXP as a
+# serial process on its own snapshots.  See 'make coefficients
+# partitioned MPI.py' in How-To/Utilities for the scheme.
+#
+import mpi4py
+mpi4py.rc.initialize = False
+mpi4py.rc.finalize   = False
 from mpi4py import MPI
 
 import pyEXP
 import numpy as np
-import pickle
+import json
 
 from os.path import exists
+from histotools import ImageStore, mergeStores
+
+# The fixed-point time and launcher rank helpers are shared with the
+# MPI scripts in How-To/Utilities
+#
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', '..', 'Utilities'))
+from mpitools import fixTime, launcherRank
 
 if (len(sys.argv)<2):
     print('Usage: {} runtag [rmax]'.format(sys.argv[0]))
@@ -22,7 +38,8 @@ if (len(sys.argv)>3):
 #
 # This script makes an image histogram in parallel using MPI.  This
 # can easily be adapted for whatever snapshots you have and could be
-# run on a cluster
+# run on a cluster.  The snapshots are dealt out between the ranks, so
+# N ranks make the histograms about N times faster.
 #
 
 # Run command is: "mpirun -np N python3 make_histo_MPI.py"
@@ -33,12 +50,6 @@ if (len(sys.argv)>3):
 # Make the file list for the snapshot sequence
 #
 
-# For making a unique fixed-point time for a dictionary key
-#
-def fixTime(time):
-    fixedD = 100000.0;
-    return int(fixedD*time+0.5)/fixedD
-
 if __name__ == "__main__":
 
     # Parameters
@@ -46,35 +57,45 @@ if __name__ == "__main__":
     beg_seq = 0
     end_seq = 10000
 
-    # Get basic information about the MPI communicator
+    # Get the rank and size from the launcher.  Check that nothing
+    # has initialized MPI behind our back, since pyEXP would then
+    # combine the snapshots of all ranks.
     #
-    world_comm = MPI.COMM_WORLD
-    world_size = world_comm.Get_size()
-    my_rank    = world_comm.Get_rank()
+    my_rank, world_size = launcherRank()
 
-    # NB: we are not using standard MPI commands on the Python side,
-    # but invoking mpi4py initializes MPI so it can be used correctly
-    # by the C++ routines
+    if MPI.Is_initialized():
+        print('MPI was initialized before the snapshot loop. '
+              'This script needs each rank to run pyEXP serially.')
+        exit(1)
 
-    # Just for info and to convince yourself check that MPI is working
+    # Just for info
     #
     print("World size is {} and my rank is {}".format(world_size, my_rank))
 
 
-    # Make a phase space file list
+    # Use the snapshot manifest if there is one (see 'make snapshot
+    # manifest.py' in How-To/Utilities).  It already knows which
+    # snapshots exist, so we do not need to probe for every file name.
     #
-    file_list = []
-    for i in range(beg_seq, end_seq):
-        file_list.append('SPL.{}.{:05d}'.format(sys.argv[1], i))
-
-    # Construct batches of files the particle reader.  One could use the
-    # parseStringList to create batches from a vector/list of files.  NB:
-    # a std::vector in C++ becomes a Python.list and vice versa
-    #
-    batches = pyEXP.read.ParticleReader.parseStringList(file_list, '')
-    xy = {}
-    xz = {}
-    yz = {}
+    manifest = 'SPL.{}.manifest'.format(sys.argv[1])
+    probe = not exists(manifest)
+
+    if not probe:
+        with open(manifest, 'r') as f:
+            batches = [v['files'] for v in json.load(f)['snapshots']]
+    else:
+        # Make a phase space file list
+        #
+        file_list = []
+        for i in range(beg_seq, end_seq):
+            file_list.append('SPL.{}.{:05d}'.format(sys.argv[1], i))
+
+        # Construct batches of files the particle reader.  One could
+        # use the parseStringList to create batches from a vector/list
+        # of files.  NB: a std::vector in C++ becomes a Python.list
+        # and vice versa
+        #
+        batches = pyEXP.read.ParticleReader.parseStringList(file_list, '')
 
     times = []
     lower = [-rmax, -rmax, -rmax]
@@ -82,17 +103,30 @@ if __name__ == "__main__":
     ngrid = [ nbin,  nbin,  nbin]
 
     fg = pyEXP.field.FieldGenerator(times, lower, upper, ngrid)
-    gd = {}
-    rd = {}
 
-    for group in batches:
+    # Each rank appends its snapshots to its own image store as they
+    # are made, and the root merges the stores at the end
+    #
+    partfile = 'imageStore.part{:04d}.h5'.format(my_rank)
+    store = ImageStore(partfile, lower, upper, ngrid, mode='w')
 
+    # Skip the snapshots that do not exist.  Every rank makes the same
+    # list, so the round robin deal below is the same everywhere.
+    #
+    groups = []
+    for group in batches:
         okay = True
         for f in group:
-            if not exists(f):
+            if probe and not exists(f):
                 okay = False
-        
-        if not okay: continue
+        if okay: groups.append(group)
+
+    my_groups = groups[my_rank::world_size]
+
+    print('Rank {} has {} of {} snapshots'.
+          format(my_rank, len(my_groups), len(groups)))
+
+    for group in my_groups:
 
         # Make the reader for the desired type.  One could probably try to
         # do this by inspection but that's another project.
@@ -103,13 +137,32 @@ if __name__ == "__main__":
         reader.SelectType(compname)
         
         tim = fixTime(reader.CurrentTime())
-        gd[tim] = fg.histo2d(reader)
-        rd[tim] = fg.histo1d(reader, rmax, nbin, "xy")
+        store.append(tim, fg.histo2d(reader), fg.histo1d(reader, rmax, nbin, "xy"))
+
+    store.close()
+
+    # Now we can safely bring up MPI and collect the store names from
+    # every rank on the root process
+    #
+    MPI.Init()
+    world_comm = MPI.COMM_WORLD
+
+    if world_comm.Get_rank() != my_rank or world_comm.Get_size() != world_size:
+        print('Rank {}: the launcher environment does not match COMM_WORLD'.
+              format(my_rank))
+        world_comm.Abort(1)
+
+    parts = world_comm.gather(partfile, root=0)
 
     if my_rank==0:
-        keys = list(gd.keys())
-        print('First time={}  last time={}'.format(keys[0], keys[-1]))
-        file = open('imagePickle', 'wb')
-        db = {'image': gd, 'histo': rd, 'lower': lower, 'upper': upper, 'ngrid': ngrid}
-        pickle.dump(db, file)
-        file.close()
+        # Merge the stores in time order and clean up
+        #
+        nframe = mergeStores(parts, 'imageStore.h5')
+        for p in parts: os.remove(p)
+
+        with ImageStore('imageStore.h5', mode='r') as store:
+            keys = store.times
+        print('Merged {} frames: first time={}  last time={}'.
+              format(nframe, keys[0], keys[-1]))
+
+    MPI.Finalize()
@@ -1,26 +1,40 @@
 import os, sys
 import numpy as np
-import pickle
 import matplotlib.pyplot as plt
 
+from histotools import ImageStore
+
 if not os.path.exists(sys.argv[1]):
     print("File <{}> does not exist?".format(sys.argv[1]))
     exit(1)
 
-file = open(sys.argv[1], 'rb')
-db = pickle.load(file)
-file.close()
+# The frames are read from the store one at a time, so this works for
+# any number of snapshots
+#
+store = ImageStore(sys.argv[1], mode='r')
+
+lower = store.lower
+upper = store.upper
+ngrid = store.ngrid
 
-image = db['image']
-lower = db['lower']
-upper = db['upper']
-ngrid = db['ngrid']
+# An optional time range [tmin, tmax) picks out the frames to show
+# using the time index of the store
+#
+ids = range(len(store))
+if len(sys.argv)>3:
+    ids = store.frames(float(sys.argv[2]), float(sys.argv[3]))
+    if isinstance(ids, slice): ids = range(ids.start, ids.stop)
 
-for v in image:
-    im = plt.imshow(image[v]["xy"].transpose(),
+times = store.times
+
+for i in ids:
+    v = times[i]
+    im = plt.imshow(store.image("xy", i).transpose(),
                     extent=[lower[0], upper[0], lower[1], upper[1]])
     plt.colorbar(im)
     plt.xlabel('x')
     plt.ylabel('y')
     plt.title('Time={}'.format(v))
     plt.show()
+
+store.close()
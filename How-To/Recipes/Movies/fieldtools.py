@@ -0,0 +1,432 @@
+"""
+Helpers for rendering fields from coefficient series
+
+'FieldGenerator.slices' and 'FieldGenerator.volumes' evaluate every
+time in the generator at once and return a dictionary of all frames.
+For a long movie, that holds every field of every frame in memory
+before the first one can be drawn.  The iterators here evaluate one
+time at a time and yield (time, fields) so that rendering can start
+right away and only one frame is held in memory:
+
+   from fieldtools import iterSlices
+
+   for t, data in iterSlices(basis, coefs, pmin, pmax, grid, fields=['dens']):
+       plot(data['dens'])
+
+FieldGenerator itself always computes every field.  With a 'fields'
+list, each frame holds only the named arrays, and for a long series
+the iterators switch to the GridEvaluator below, which computes only
+those fields (see 'useTable').  Volumes come in x-y-z index order;
+'layout="zyx"' gives z-y-x order, as wanted by e.g. k3d's
+'marching_cubes'.
+
+For many frames on the same grid, the GridEvaluator tabulates the
+fields of every basis function on the grid once.  Each frame is then a
+matrix product of the table with the coefficients:
+
+   evaluator = GridEvaluator(basis, coefs, pmin, pmax, grid, fields=['dens'],
+                             cachefile='grid.cache.npz', config=config)
+   for t, data in evaluator.iterate():
+       plot(data['dens'])
+
+For the periodic 'cube' basis on a uniform grid, the CubeFFTEvaluator
+does the same with inverse FFTs, which makes 128^3 and bigger volumes
+practical.  'iterVolumes' uses it by itself when the grid and the
+coefficients allow, or you can make one directly:
+
+   evaluator = CubeFFTEvaluator(basis, coefs, [0,0,0], [1,1,1], [129,129,129])
+
+Import this file from a notebook in this directory.
+"""
+
+import os
+import re
+import hashlib
+import numpy as np
+import pyEXP
+
+
+def selectFields(data, fields):
+    """Keep the named fields of a frame dictionary"""
+    if fields is None: return data
+    missing = [v for v in fields if v not in data]
+    if missing:
+        raise KeyError('fields {} are not in {}'.format(missing, list(data.keys())))
+    return {v: data[v] for v in fields}
+
+
+def toLayout(data, layout):
+    """Put the volumes of a frame dictionary in 'xyz' or 'zyx' index order
+
+    The arrays from pyEXP are usually in Fortran order, and then the
+    z-y-x arrays are C-contiguous views with no copy.  Otherwise one
+    vectorized copy is made.
+    """
+    if layout == 'xyz': return data
+    if layout != 'zyx':
+        raise ValueError('layout must be "xyz" or "zyx", not "{}"'.format(layout))
+    return {v: np.ascontiguousarray(np.asarray(d).transpose()) for v, d in data.items()}
+
+
+def useTable(coefs, grid, times, fields, maxtable=2*1024**3):
+    """Decide whether a GridEvaluator table pays off for these frames
+
+    FieldGenerator computes every field at every grid point, whatever
+    is asked for.  The table computes only the requested fields, but
+    making it costs one FieldGenerator call per real degree of freedom
+    of the coefficients.  So we use it for a subset of the fields when
+    there are more frames than that and the table fits in 'maxtable'
+    bytes.
+    """
+    if fields is None: return False
+    C = np.asarray(coefs.getCoefStruct(coefs.Times()[0]).getCoefs())
+    ncol = C.size*(2 if np.iscomplexobj(C) else 1)
+    npts = int(np.prod([max(n, 1) for n in grid]))
+    return len(times) > ncol and 8*npts*ncol*len(fields) <= maxtable
+
+
+def iterDirect(method, basis, coefs, pmin, pmax, grid, times, fields, layout):
+    """Evaluate a FieldGenerator method one time at a time"""
+    for t in times:
+        generator = pyEXP.field.FieldGenerator([t], pmin, pmax, grid)
+        frame = getattr(generator, method)(basis, coefs)
+        # There is only one time in the returned dictionary
+        #
+        for data in frame.values():
+            yield t, toLayout(selectFields(data, fields), layout)
+
+
+def iterFields(method, basis, coefs, pmin, pmax, grid, times=None, fields=None,
+               layout='xyz', table=None):
+    """Evaluate the fields one time at a time
+
+    method : 'slices' or 'volumes'
+    times  : the times to evaluate (default: all of coefs.Times())
+    fields : the names of the fields to keep, e.g. ['dens'] (default: all)
+    layout : the index order of the arrays, 'xyz' (default) or 'zyx'
+    table  : True or False to force or refuse a GridEvaluator table
+             (default: decided by 'useTable')
+
+    Returns an iterator of (time, fields) where fields is the
+    dictionary of arrays for that time.
+    """
+    if times is None: times = coefs.Times()
+    if table is None: table = useTable(coefs, grid, times, fields)
+
+    if table:
+        evaluator = GridEvaluator(basis, coefs, pmin, pmax, grid, method,
+                                  fields, layout=layout)
+        return evaluator.iterate(times)
+
+    return iterDirect(method, basis, coefs, pmin, pmax, grid, times, fields, layout)
+
+
+def iterSlices(basis, coefs, pmin, pmax, grid, times=None, fields=None,
+               table=None):
+    """Lazy version of 'FieldGenerator.slices'"""
+    return iterFields('slices', basis, coefs, pmin, pmax, grid, times, fields,
+                      table=table)
+
+
+def iterVolumes(basis, coefs, pmin, pmax, grid, times=None, fields=None,
+                layout='xyz', fft=True, table=None):
+    """Lazy version of 'FieldGenerator.volumes'
+
+    When the grid fits a periodic grid on the unit cube and the
+    coefficients are those of the cube basis, the volumes are made by
+    the CubeFFTEvaluator below.  Otherwise, or with fft=False, they are
+    made as in 'iterFields'.
+    """
+    if fft and periodicGrid(pmin, pmax, grid) is not None:
+        try:
+            evaluator = CubeFFTEvaluator(basis, coefs, pmin, pmax, grid,
+                                         fields, layout)
+            return evaluator.iterate(times)
+        except ValueError:
+            pass
+        except RuntimeError as e:
+            print('{}; using the direct evaluation'.format(e))
+    return iterFields('volumes', basis, coefs, pmin, pmax, grid, times, fields,
+                      layout, table)
+
+
+def basisKey(config):
+    """Identity of a basis from its YAML config and the files it names
+
+    The hash covers the config text and the size and modification time
+    of the model and cache files in it, so a table made for one basis
+    is not used for another with the same grid and coefficient shape.
+    """
+    h = hashlib.sha256(config.encode())
+    for name in re.findall(r'(?:modelname|cachename|eof_file)\s*:\s*([^\s,}]+)', config):
+        if os.path.exists(name):
+            st = os.stat(name)
+            h.update('{}:{}:{}'.format(name, st.st_size, st.st_mtime_ns).encode())
+    return h.hexdigest()
+
+
+class GridEvaluator:
+    """Fields on a fixed grid as a matrix product with the coefficients
+
+    The fields are linear in the real and imaginary parts of the
+    coefficients.  So we evaluate the fields once for each unit
+    coefficient (one FieldGenerator call per real degree of freedom)
+    and keep the results as the columns of a table.  After that, a
+    frame costs one BLAS matrix product, and 'iterate' does a batch of
+    times with a single product.  The fields default to ['dens'].
+
+    The table costs as much as two frames per complex coefficient, so
+    this pays off for movies with many more frames than that.  Ask for
+    the fields that you need: each one is a table of (number of grid
+    points) x (2 x number of coefficients) doubles.  With 'cachefile',
+    the table is saved with np.savez and reused when the basis, grid,
+    method, fields and coefficient shape match.  The basis is known by
+    the YAML 'config' that made it, which is then required.  With
+    layout='zyx', the table rows are reordered once so that volumes
+    come out in z-y-x order.
+    """
+
+    def __init__(self, basis, coefs, pmin, pmax, grid, method='slices',
+                 fields=None, cachefile=None, layout='xyz', config=None):
+        if cachefile is not None and config is None:
+            raise ValueError('GridEvaluator: a cachefile needs the basis config')
+
+        # np.savez adds the '.npz' suffix if it is missing, so use the
+        # name that it writes for the lookup too
+        #
+        if cachefile is not None and not cachefile.endswith('.npz'):
+            cachefile += '.npz'
+
+        self.coefs  = coefs
+        self.method = method
+        self.fields = ['dens'] if fields is None else list(fields)
+        self.layout = layout
+
+        t0 = coefs.Times()[0]
+        self.template = coefs.getCoefStruct(t0)
+        C = np.asarray(self.template.getCoefs())
+        self.cshape  = C.shape
+        self.complex = np.iscomplexobj(C)
+
+        key = {'pmin': np.asarray(pmin, dtype=float), 'pmax': np.asarray(pmax, dtype=float),
+               'grid': np.asarray(grid), 'cshape': np.asarray(self.cshape),
+               'method': method, 'fields': '|'.join(self.fields)}
+        if config is not None: key['basis'] = basisKey(config)
+
+        self.table = None
+        if cachefile is not None and os.path.exists(cachefile):
+            self.table = self.readCache(cachefile, key)
+
+        if self.table is None:
+            self.table = self.tabulate(basis, t0, pmin, pmax, grid)
+            if cachefile is not None:
+                np.savez(cachefile, shape=np.asarray(self.shape), **key,
+                         **{'table ' + v: self.table[v] for v in self.fields})
+
+        # For the z-y-x layout, permute the table rows once so that
+        # every frame comes out of the product in that order
+        #
+        if layout == 'zyx':
+            perm = np.arange(int(np.prod(self.shape))).reshape(self.shape).transpose().ravel()
+            self.table = {v: self.table[v][perm] for v in self.fields}
+            self.shape = tuple(self.shape[::-1])
+        elif layout != 'xyz':
+            raise ValueError('layout must be "xyz" or "zyx", not "{}"'.format(layout))
+
+    def readCache(self, cachefile, key):
+        """Read the table from the cache if it was made for this setup"""
+        with np.load(cachefile) as db:
+            for k, v in key.items():
+                if k not in db or not np.array_equal(db[k], v):
+                    print('GridEvaluator: <{}> does not match, recomputing'.format(cachefile))
+                    return None
+            self.shape = tuple(db['shape'])
+            return {v: db['table ' + v] for v in self.fields}
+
+    def unitCoefs(self, t0, k):
+        """Coefficient container with a single unit real degree of freedom"""
+        n = int(np.prod(self.cshape))
+        C = np.zeros(n, dtype=complex if self.complex else float)
+        if k < n: C[k] = 1.0
+        else:     C[k - n] = 1.0j
+        coef = self.template.deepcopy()
+        coef.setCoefs(C.reshape(self.cshape))
+        unit = pyEXP.coefs.Coefs.makecoefs(coef, 'unit')
+        unit.add(coef)
+        return unit
+
+    def tabulate(self, basis, t0, pmin, pmax, grid):
+        """Evaluate the fields for each unit coefficient on the grid"""
+        n = int(np.prod(self.cshape))
+        ncol = 2*n if self.complex else n
+
+        generator = pyEXP.field.FieldGenerator([t0], pmin, pmax, grid)
+        table = {}
+        for k in range(ncol):
+            frame = getattr(generator, self.method)(basis, self.unitCoefs(t0, k))
+            for data in frame.values():
+                data = selectFields(data, self.fields)
+                for v in self.fields:
+                    if v not in table:
+                        self.shape = np.asarray(data[v]).shape
+                        table[v] = np.empty((int(np.prod(self.shape)), ncol))
+                    table[v][:,k] = np.asarray(data[v]).ravel()
+        return table
+
+    def coefVector(self, t):
+        """The real coefficient vector for time t"""
+        C = np.asarray(self.coefs.getCoefStruct(t).getCoefs()).ravel()
+        if self.complex:
+            return np.concatenate([C.real, C.imag])
+        return C
+
+    def __call__(self, t):
+        """The field dictionary for time t"""
+        x = self.coefVector(t)
+        return {v: (self.table[v] @ x).reshape(self.shape) for v in self.fields}
+
+    def iterate(self, times=None, batch=32):
+        """Yield (time, fields) for each time, 'batch' times per product"""
+        if times is None: times = self.coefs.Times()
+        for beg in range(0, len(times), batch):
+            tb = times[beg:beg+batch]
+            X  = np.column_stack([self.coefVector(t) for t in tb])
+            F  = {v: self.table[v] @ X for v in self.fields}
+            for i, t in enumerate(tb):
+                yield t, {v: F[v][:,i].reshape(self.shape) for v in self.fields}
+
+
+def periodicGrid(pmin, pmax, grid):
+    """Match a uniform grid to a periodic grid on the unit cube
+
+    The grid points pmin + (pmax - pmin)*i/(grid - 1) must fall on the
+    points j/L of a periodic grid.  Returns the list of (L, offset)
+    for the three axes or None if the grid does not fit.
+    """
+    axes = []
+    for a, b, n in zip(pmin, pmax, grid):
+        if n < 2 or b <= a: return None
+        L = int(round((n - 1)/(b - a)))
+        offset = int(round(a*L))
+        if L < 1 or abs((n - 1)/(b - a) - L) > 1.0e-8*L or abs(a*L - offset) > 1.0e-8*L:
+            return None
+        axes.append((L, offset))
+    return axes
+
+
+class CubeFFTEvaluator:
+    """Volumes of the periodic cube basis by inverse FFT
+
+    The cube basis is a Fourier series on the unit cube with wave
+    numbers -nmax, ..., nmax on each axis, so every field is a sum of
+    c_k g(k) exp(2 pi i k.x) where g(k) is a fixed factor for each field
+    (the Poisson kernel for the potential, i k times that for the
+    forces, etc).  We measure g(k) once from a direct evaluation of
+    random Hermitian coefficients on the smallest periodic grid that
+    resolves all modes, so this follows the normalization of the pyEXP
+    basis exactly.  A second random set checks the result on a grid
+    with twice as many points per axis: on the calibration grid, wave
+    number k can not be told from k +/- n, so a check there would miss
+    a wrong frequency mapping.  After that, each time costs one zero-padded inverse FFT per field:
+    O(N log N) rather than O(N nmodes) for N grid points.
+
+    The grid must be uniform and its points must fall on a periodic
+    grid j/L of the unit cube with L >= 2*nmax+1 on each axis, e.g.
+    pmin=[0,0,0], pmax=[1,1,1] and any grid >= 2*nmax+2.  Otherwise a
+    ValueError is raised and 'iterVolumes' evaluates directly.  With
+    fields=None, all of the fields of 'FieldGenerator.volumes' are made.
+    """
+
+    def __init__(self, basis, coefs, pmin, pmax, grid, fields=None,
+                 layout='xyz', seed=11, check=True):
+        self.coefs  = coefs
+        self.fields = None if fields is None else list(fields)
+        self.layout = layout
+        self.npts   = list(grid)
+        if layout not in ['xyz', 'zyx']:
+            raise ValueError('layout must be "xyz" or "zyx", not "{}"'.format(layout))
+
+        t0 = coefs.Times()[0]
+        self.template = coefs.getCoefStruct(t0)
+        self.cshape = np.asarray(self.template.getCoefs()).shape
+        if len(self.cshape) != 3 or any(n % 2 == 0 for n in self.cshape):
+            raise ValueError('CubeFFTEvaluator: {} is not a cube coefficient shape'.
+                             format(self.cshape))
+        self.nmax = [(n - 1)//2 for n in self.cshape]
+
+        self.axes = periodicGrid(pmin, pmax, grid)
+        if self.axes is None or any(L < n for (L, o), n in zip(self.axes, self.cshape)):
+            raise ValueError('CubeFFTEvaluator: the grid does not fit a periodic grid '
+                             'with at least {} points per axis'.format(list(self.cshape)))
+
+        # The wave numbers of the coefficient array along each axis and
+        # their positions in the FFT arrays of the calibration grid
+        #
+        self.kvec = [np.arange(-n, n+1) for n in self.nmax]
+
+        rng = np.random.default_rng(seed)
+        C = self.hermitian(rng)
+        data = self.direct(basis, t0, C)
+        if self.fields is None: self.fields = list(data.keys())
+
+        M = np.prod(self.cshape)
+        self.kernel = {}
+        for v in self.fields:
+            F = np.fft.fftn(np.asarray(data[v]))/M
+            self.kernel[v] = F[np.ix_(*[k % n for k, n in zip(self.kvec, self.cshape)])]/C
+
+        if check:
+            C = self.hermitian(rng)
+            fine = [2*n for n in self.cshape]
+            data = self.direct(basis, t0, C, fine)
+            for v in self.fields:
+                ref = np.asarray(data[v])
+                fft = self.evaluate(C, v, [(n, 0) for n in fine], fine, 'xyz')
+                err = np.max(np.abs(fft - ref))/max(np.max(np.abs(ref)), np.finfo(float).tiny)
+                if err > 1.0e-6:
+                    raise RuntimeError('CubeFFTEvaluator: field "{}" does not match the '
+                                       'direct evaluation (relative error {:.2e})'.format(v, err))
+
+    def hermitian(self, rng):
+        """Random coefficients with C(-k) = conj(C(k)), i.e. a real field"""
+        C = rng.normal(size=self.cshape) + 1j*rng.normal(size=self.cshape)
+        return 0.5*(C + np.conj(C[::-1,::-1,::-1]))
+
+    def direct(self, basis, t0, C, npts=None):
+        """The fields for coefficients C on the periodic grid j/n
+
+        The default is the calibration grid with n = the coefficient
+        shape.
+        """
+        if npts is None: npts = list(self.cshape)
+        coef = self.template.deepcopy()
+        coef.setCoefs(C)
+        unit = pyEXP.coefs.Coefs.makecoefs(coef, 'calibrate')
+        unit.add(coef)
+        pmin = [0.0, 0.0, 0.0]
+        pmax = [(n - 1)/n for n in npts]
+        generator = pyEXP.field.FieldGenerator([t0], pmin, pmax, list(npts))
+        for data in generator.volumes(basis, unit).values():
+            return selectFields(data, self.fields)
+
+    def evaluate(self, C, v, axes, npts, layout):
+        """Field v for coefficients C at npts points along the (L, offset) axes"""
+        shape = [L for L, o in axes]
+        A = np.zeros(shape, dtype=complex)
+        A[np.ix_(*[k % L for k, L in zip(self.kvec, shape)])] = C*self.kernel[v]
+        f = np.fft.ifftn(A).real*np.prod(shape)
+        f = f[np.ix_(*[(o + np.arange(n)) % L for (L, o), n in zip(axes, npts)])]
+        if layout == 'zyx':
+            f = np.ascontiguousarray(f.transpose())
+        return f
+
+    def __call__(self, t):
+        """The field dictionary for time t"""
+        C = np.asarray(self.coefs.getCoefStruct(t).getCoefs())
+        return {v: self.evaluate(C, v, self.axes, self.npts, self.layout) for v in self.fields}
+
+    def iterate(self, times=None):
+        """Yield (time, fields) for each time"""
+        if times is None: times = self.coefs.Times()
+        for t in times:
+            yield t, self(t)
@@ -0,0 +1,149 @@
+"""
+Render movie frames in parallel and stream them to ffmpeg
+
+The movie notebooks draw each frame with matplotlib, save it as a PNG
+and then run ffmpeg over the PNG files.  Here, a pool of worker
+processes draws the frames into raw RGB buffers and the parent process
+pipes the buffers, in frame order, into a single ffmpeg encoder:
+
+   from movietools import renderMovie
+
+   renderMovie(((t, d['dens']) for t, d in iterSlices(...)), 'movie.mp4',
+               pmin, pmax, levels=10**np.arange(0.0, 4.7, 0.1))
+
+The contour levels, color limits and color map are fixed for the
+whole movie so that the frames are consistent.  ffmpeg must be on
+your path.  Import this file from a notebook in this directory.
+"""
+
+import copy
+import subprocess
+import multiprocessing as mp
+
+import numpy as np
+import matplotlib
+from matplotlib import ticker
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+
+# The render settings are given to each worker once when the pool
+# starts, rather than with every frame.  Workers that are spawned
+# rather than forked start with the default matplotlib rcParams, so
+# the caller's rcParams travel with the settings.
+#
+settings = {}
+
+def initWorker(config):
+    settings.clear()
+    settings.update(config)
+    matplotlib.rcParams.update(config['rc'])
+
+
+def changedParams():
+    """The rcParams that differ from the matplotlib defaults
+
+    The backend is left out since the workers draw on an Agg canvas.
+    """
+    return {k: v for k, v in matplotlib.rcParams.items()
+            if not k.startswith('backend') and v != matplotlib.rcParamsDefault[k]}
+
+
+def renderFrame(task):
+    """Draw one frame and return its index and the RGB bytes"""
+    icnt, t, mat = task
+    s = settings
+
+    # Clip into the range of the levels, which keeps the colors of
+    # the lowest and highest contours from flickering
+    #
+    mat = np.clip(mat, s['vmin'], s['vmax'])
+
+    x = np.linspace(s['pmin'][0], s['pmax'][0], mat.shape[0])
+    y = np.linspace(s['pmin'][1], s['pmax'][1], mat.shape[1])
+    xv, yv = np.meshgrid(x, y)
+
+    cmap = copy.copy(matplotlib.colormaps[s['cmap']])
+    cmap.set_under(cmap(1))
+    cmap.set_over(cmap(cmap.N-1))
+
+    # Draw straight onto an Agg canvas so that the workers do not
+    # touch pyplot or the notebook backend
+    #
+    fig = Figure(figsize=s['figsize'], dpi=s['dpi'])
+    canvas = FigureCanvasAgg(fig)
+    ax = fig.subplots()
+    locator = ticker.LogLocator() if s['log'] else None
+    cont = ax.contourf(xv, yv, mat.transpose(), s['levels'], cmap=cmap, locator=locator)
+    if s['lines'] is not None:
+        ax.contour(xv, yv, mat.transpose(), s['lines'], colors='k')
+    fig.colorbar(cont, ax=ax)
+    ax.set_xlabel('x')
+    ax.set_ylabel('y')
+    ax.set_title(s['title'].format(t))
+
+    canvas.draw()
+    rgb = np.asarray(canvas.buffer_rgba())[:,:,:3]
+
+    # The yuv420p pixel format needs an even width and height
+    #
+    h, w = rgb.shape[0] & ~1, rgb.shape[1] & ~1
+    return icnt, np.ascontiguousarray(rgb[:h,:w]).tobytes(), (w, h)
+
+
+class MovieWriter:
+    """An ffmpeg process that encodes raw RGB frames from a pipe"""
+
+    def __init__(self, filename, width, height, fps=25, codec='libx264'):
+        command = ['ffmpeg', '-y', '-loglevel', 'error',
+                   '-f', 'rawvideo', '-pix_fmt', 'rgb24',
+                   '-s', '{}x{}'.format(width, height), '-r', str(fps),
+                   '-i', '-',
+                   '-vcodec', codec, '-pix_fmt', 'yuv420p', filename]
+        self.proc = subprocess.Popen(command, stdin=subprocess.PIPE)
+
+    def write(self, frame):
+        self.proc.stdin.write(frame)
+
+    def close(self):
+        self.proc.stdin.close()
+        return self.proc.wait()
+
+
+def renderMovie(frames, filename, pmin, pmax, levels, lines=None,
+                cmap='viridis', log=True, title='T={:4.3f}',
+                figsize=(12, 10), dpi=75, fps=25, processes=None, rc=None):
+    """Render (time, 2d array) frames into a movie file
+
+    frames    : an iterable of (time, array) pairs, e.g. from 'iterSlices'
+    levels    : the filled contour levels; the data is clipped to their range
+    lines     : optional contour line levels
+    processes : the number of worker processes (default: all cores)
+    rc        : rcParams for the workers (default: the caller's rcParams
+                that differ from the matplotlib defaults)
+
+    Returns the number of frames written.
+    """
+    config = {'pmin': pmin, 'pmax': pmax, 'levels': levels, 'lines': lines,
+              'vmin': levels[0], 'vmax': levels[-1], 'cmap': cmap, 'log': log,
+              'title': title, 'figsize': figsize, 'dpi': dpi,
+              'rc': changedParams() if rc is None else rc}
+
+    tasks = ((i, t, np.asarray(mat)) for i, (t, mat) in enumerate(frames))
+
+    writer = None
+    nframe = 0
+    with mp.Pool(processes, initializer=initWorker, initargs=(config,)) as pool:
+        # 'imap' hands back the frames in order while the workers run
+        # ahead on the frames that follow
+        #
+        for icnt, rgb, (w, h) in pool.imap(renderFrame, tasks):
+            if writer is None:
+                writer = MovieWriter(filename, w, h, fps)
+            writer.write(rgb)
+            nframe += 1
+
+    if writer is not None and writer.close() != 0:
+        raise RuntimeError('ffmpeg failed to write <{}>'.format(filename))
+
+    return nframe
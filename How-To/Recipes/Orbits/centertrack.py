@@ -0,0 +1,132 @@
+"""
+Expansion center trajectories for orbit integration in moving frames
+
+The moving frame recipes build lists of center times and positions
+by hand, and the Gadget scripts write the centers to a loose text
+file.  A CenterTrajectory keeps the track together with the
+coefficients: it is stored as a dataset in the coefficient HDF5 file,
+fitted with a smoothing spline to remove the noise of the center
+estimate, and resampled to whatever times 'setNonInertial' needs:
+
+   from centertrack import CenterTrajectory
+
+   track = CenterTrajectory.fromText('new.centers')
+   track.write('outcoef.halo.h5')          # once, after making the coefficients
+
+   track = CenterTrajectory.read('outcoef.halo.h5').fit()
+   track.apply(halo_basis, 40)             # calls setNonInertial
+
+A noisy track has a noisy second derivative, and the frame
+acceleration then forces the orbit integrator to take tiny steps.  The
+spline fit avoids that.  SciPy >= 1.10 and h5py are needed.
+"""
+
+import h5py
+import numpy as np
+from scipy.interpolate import make_smoothing_spline
+
+
+class CenterTrajectory:
+    """Times and positions of an expansion center"""
+
+    # The dataset name in the coefficient file.  EXP keeps the
+    # coefficients in the 'snapshots' group, so a top-level dataset
+    # does not get in the way of Coefs.factory or ExtendH5Coefs.
+    #
+    dataset = 'center trajectory'
+
+    def __init__(self, times, centers):
+        times   = np.asarray(times, dtype=float)
+        centers = np.asarray(centers, dtype=float).reshape(-1, 3)
+        if len(times) != len(centers):
+            raise ValueError('CenterTrajectory: {} times but {} centers'.
+                             format(len(times), len(centers)))
+
+        # Keep the last center for a repeated time, e.g. from a
+        # restarted run, and put everything in time order
+        #
+        rev = slice(None, None, -1)
+        times, indx = np.unique(times[rev], return_index=True)
+        self.times   = times
+        self.centers = centers[rev][indx]
+        self.splines = None
+
+    @classmethod
+    def fromText(cls, filename):
+        """Read a 'time x y z' table, e.g. from 'find center (parallel).py'
+
+        Lines that do not parse as numbers (such as a column header)
+        are skipped.
+        """
+        data = np.genfromtxt(filename, usecols=(0, 1, 2, 3), invalid_raise=False)
+        data = data[np.all(np.isfinite(data), axis=1)]
+        return cls(data[:,0], data[:,1:4])
+
+    @classmethod
+    def fromCoefs(cls, coefs):
+        """Get the centers stored with each coefficient set"""
+        times = coefs.Times()
+        return cls(times, [coefs.getCoefStruct(t).getCoefCenter() for t in times])
+
+    @classmethod
+    def read(cls, h5file):
+        """Read the trajectory from a coefficient HDF5 file"""
+        with h5py.File(h5file, 'r') as f:
+            data = f[cls.dataset][:]
+        return cls(data[:,0], data[:,1:4])
+
+    def write(self, h5file):
+        """Store the trajectory in a coefficient HDF5 file, replacing any old one"""
+        with h5py.File(h5file, 'a') as f:
+            if self.dataset in f: del f[self.dataset]
+            f.create_dataset(self.dataset, data=np.column_stack([self.times, self.centers]))
+
+    def fit(self, lam=None):
+        """Fit a smoothing spline to each coordinate
+
+        The smoothing parameter 'lam' is chosen by generalized cross
+        validation if it is not given.  Returns self so that calls can
+        be chained.
+        """
+        if len(self.times) < 5:
+            raise ValueError('CenterTrajectory: need at least 5 centers for a spline fit')
+        self.splines = [make_smoothing_spline(self.times, self.centers[:,i], lam=lam)
+                        for i in range(3)]
+        return self
+
+    def __call__(self, t, nu=0):
+        """Center positions at times t as an (len(t), 3) array
+
+        Uses the spline fit if there is one, and linear interpolation
+        otherwise.  Use nu=1 or nu=2 for the velocity or acceleration
+        of the spline fit.
+        """
+        t = np.atleast_1d(np.asarray(t, dtype=float))
+        if self.splines is not None:
+            return np.column_stack([s(t, nu) for s in self.splines])
+        if nu != 0:
+            raise ValueError('CenterTrajectory: derivatives need a spline fit')
+        return np.column_stack([np.interp(t, self.times, self.centers[:,i])
+                                for i in range(3)])
+
+    def resample(self, times=None, dt=None):
+        """Evaluate the track on new times or with a uniform step dt
+
+        With no arguments, the original times are used.
+        """
+        if times is None:
+            if dt is None:
+                times = self.times
+            else:
+                times = np.arange(self.times[0], self.times[-1] + 0.5*dt, dt)
+        times = np.asarray(times, dtype=float)
+        return times, self(times)
+
+    def apply(self, basis, N, times=None, dt=None):
+        """Put the basis in the non-inertial frame of this trajectory
+
+        N is passed on to 'setNonInertial'.  The times are chosen as in
+        'resample'.
+        """
+        times, centers = self.resample(times, dt)
+        basis.setNonInertial(N, times.tolist(), centers.tolist())
@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+
+"""
+Measure the coefficient construction throughput of pyEXP
+
+Makes synthetic Plummer and Hernquist halos and exponential disks,
+builds the 'dark halo' (sphereSL) and 'star disk' (cylinder) bases
+from the EXP config in Tutorials/Data, and times the coefficient
+construction for a range of particle numbers and basis sizes.  The
+results (particles per second and memory for each case) are written
+to a JSON file so that releases and machines can be compared.
+
+The basis caches for each (Lmax, nmax) and (mmax, nmax) are made in a
+separate bench directory (see -b), so the caches in Tutorials/Data are
+never touched.  The memory of a case is the peak resident set size
+sampled while the case runs and its growth over the size at the start
+of the case.
+
+OpenMP threads and MPI ranks are taken from the environment; run the
+script once per setting, e.g.
+
+   OMP_NUM_THREADS=8 python3 'benchmark coefficient throughput.py' -o omp8.json
+   mpirun -np 4 python3 'benchmark coefficient throughput.py' -o mpi4.json
+
+With MPI, every rank makes the same particles and 'createFromArray'
+shares them out round robin.  Particle numbers above the array limit
+(see -a) are generated and accumulated in chunks with 'addFromArray'
+so that 1e8 bodies fit in memory.  Only the pyEXP calls are timed.
+"""
+
+import os, sys, getopt, json, time, socket, resource, threading
+import yaml
+import numpy as np
+import pyEXP
+
+try:
+    from mpi4py import MPI
+    comm = MPI.COMM_WORLD
+except ImportError:
+    comm = None
+
+
+def help(phrase: str) -> None:
+    """Print some usage info"""
+    print(phrase)
+
+
+def isotropic(rng, r):
+    """Place particles at radii r in random directions"""
+    cth = 2.0*rng.random(r.size) - 1.0
+    sth = np.sqrt(1.0 - cth*cth)
+    phi = 2.0*np.pi*rng.random(r.size)
+    return [r*sth*np.cos(phi), r*sth*np.sin(phi), r*cth]
+
+
+def plummer(rng, n, a, rmax):
+    """Plummer sphere with scale a, truncated at rmax"""
+    umax = (rmax*rmax/(rmax*rmax + a*a))**1.5
+    u = umax*rng.random(n)
+    return isotropic(rng, a/np.sqrt(u**(-2.0/3.0) - 1.0))
+
+
+def hernquist(rng, n, a, rmax):
+    """Hernquist sphere with scale a, truncated at rmax"""
+    umax = rmax*rmax/(rmax + a)**2
+    s = np.sqrt(umax*rng.random(n))
+    return isotropic(rng, a*s/(1.0 - s))
+
+
+def expdisk(rng, n, a, h, rmax):
+    """Exponential disk with scale length a and sech^2 scale height h"""
+    R = a*rng.gamma(2.0, size=n)
+    while np.any(R>rmax):
+        bad = R>rmax
+        R[bad] = a*rng.gamma(2.0, size=np.count_nonzero(bad))
+    phi = 2.0*np.pi*rng.random(n)
+    z = h*np.arctanh(2.0*rng.random(n) - 1.0)
+    return [R*np.cos(phi), R*np.sin(phi), z]
+
+
+def getConfig(datadir, component, params, cachename):
+    """Get the force config for a component with some parameters changed
+
+    The model file is found in 'datadir' and the basis cache is
+    written to 'cachename'.
+    """
+    with open(os.path.join(datadir, 'config.yml'), 'r') as f:
+        db = yaml.load(f, Loader=yaml.FullLoader)
+    for v in db['Components']:
+        if v['name'] == component:
+            force = v['force']
+            force['parameters'].update(params)
+            if 'modelname' in force['parameters']:
+                force['parameters']['modelname'] = \
+                    os.path.join(datadir, force['parameters']['modelname'])
+            force['parameters']['cachename'] = cachename
+            return yaml.dump(force)
+    raise KeyError(component)
+
+
+def residentMemory():
+    """Current resident set size of this process in MB
+
+    Falls back to the peak size where /proc is not available.
+    """
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1])*os.sysconf('SC_PAGE_SIZE')/1024.0**2
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.0
+
+
+class MemorySampler:
+    """Sample the resident set size in a background thread
+
+    'ru_maxrss' is the high-water mark of the whole process, so a small
+    case run after a large one would report the large one.  Use as a
+    context manager around one case; 'start' and 'peak' are in MB.
+    """
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+
+    def __enter__(self):
+        self.start = self.peak = residentMemory()
+        self.done  = threading.Event()
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+        self.thread.start()
+        return self
+
+    def sample(self):
+        while not self.done.wait(self.interval):
+            self.peak = max(self.peak, residentMemory())
+
+    def __exit__(self, *args):
+        self.done.set()
+        self.thread.join()
+        self.peak = max(self.peak, residentMemory())
+
+
+def timeBasis(basis, model, n, nrep, maxarray, chunk, seed):
+    """Time the coefficient construction for n bodies of a model
+
+    Returns the best and mean wall clock time over 'nrep' trials.
+    """
+    rng  = np.random.default_rng(seed)
+    mass = 1.0/n
+    wall = []
+
+    if n <= maxarray:
+        pos = model(rng, n)
+        m   = np.full(n, mass)
+        for i in range(nrep):
+            if comm is not None: comm.Barrier()
+            t0 = time.time()
+            basis.createFromArray(m, pos, time=0.0)
+            wall.append(time.time() - t0)
+    else:
+        for i in range(nrep):
+            rng = np.random.default_rng(seed)
+            if comm is not None: comm.Barrier()
+            basis.initFromArray()
+            used = 0.0
+            for beg in range(0, n, chunk):
+                k = min(chunk, n - beg)
+                pos = model(rng, k)
+                m   = np.full(k, mass)
+                t0 = time.time()
+                basis.addFromArray(m, pos)
+                used += time.time() - t0
+            t0 = time.time()
+            basis.makeFromArray(time=0.0)
+            wall.append(used + time.time() - t0)
+
+    return min(wall), sum(wall)/len(wall)
+
+
+def main(prog, argv) -> int:
+    """Run the benchmark sweep"""
+
+    datadir  = os.path.join(os.path.dirname(os.path.abspath(prog)),
+                            '..', '..', 'Tutorials', 'Data')
+    benchdir = 'benchmark_caches'
+    output   = 'coefficient_benchmark.json'
+    numbers  = [100000, 1000000, 10000000]
+    spheres  = [(4, 10), (6, 20)]            # (Lmax, nmax)
+    disks    = [(6, 12)]                     # (mmax, nmax)
+    nrep     = 3
+    maxarray = 10000000
+    chunk    = 1000000
+    seed     = 11
+
+    phrase = prog + ': [-h] [-o|--output file.json] [-d|--data dir] [-b|--bench dir] [-N|--number n1,n2,...] [-s|--sphere L:n,...] [-c|--cylinder m:n,...] [-r|--repeat n] [-a|--array n]'
+
+    try:
+        opts, args = getopt.getopt(argv, "ho:d:b:N:s:c:r:a:", ["output=", "data=", "bench=", "number=", "sphere=", "cylinder=", "repeat=", "array="])
+    except getopt.GetoptError:
+        help(phrase)
+        return 2
+
+    for opt, arg in opts:
+        if opt == '-h':
+            help(phrase)
+            return 0
+        elif opt in ("-o", "--output"):
+            output = arg
+        elif opt in ("-d", "--data"):
+            datadir = arg
+        elif opt in ("-b", "--bench"):
+            benchdir = arg
+        elif opt in ("-N", "--number"):
+            numbers = [int(float(v)) for v in arg.split(',')]
+        elif opt in ("-s", "--sphere"):
+            spheres = [tuple(int(u) for u in v.split(':')) for v in arg.split(',') if len(v)]
+        elif opt in ("-c", "--cylinder"):
+            disks = [tuple(int(u) for u in v.split(':')) for v in arg.split(',') if len(v)]
+        elif opt in ("-r", "--repeat"):
+            nrep = int(arg)
+        elif opt in ("-a", "--array"):
+            maxarray = int(float(arg))
+
+    my_rank = 0 if comm is None else comm.Get_rank()
+    nprocs  = 1 if comm is None else comm.Get_size()
+
+    # The model files are read from the data directory.  Each basis
+    # size gets its own cache file in the bench directory, which is
+    # also the working directory, so nothing is written to the data
+    # directory.  A cache is made on the first run if it is not there
+    # yet, outside of the timed calls.
+    #
+    output   = os.path.abspath(output)
+    datadir  = os.path.abspath(datadir)
+    benchdir = os.path.abspath(benchdir)
+    os.makedirs(benchdir, exist_ok=True)
+    os.chdir(benchdir)
+
+    # The halo models follow the 'dark halo' scale and the disk model
+    # follows the 'star disk' scales in config.yml
+    #
+    cases = []
+    for Lmax, nmax in spheres:
+        cases.append(('sphereSL', 'dark halo', {'Lmax': Lmax, 'nmax': nmax},
+                      'SLGridSph.cache.L{}n{}'.format(Lmax, nmax),
+                      {'plummer'   : lambda rng, n: plummer(rng, n, 0.05, 1.95),
+                       'hernquist' : lambda rng, n: hernquist(rng, n, 0.0667, 1.95)}))
+    for mmax, nmax in disks:
+        cases.append(('cylinder', 'star disk', {'mmax': mmax, 'nmax': nmax},
+                      'eof.cache.m{}n{}'.format(mmax, nmax),
+                      {'expdisk'   : lambda rng, n: expdisk(rng, n, 0.01, 0.001, 0.2)}))
+
+    results = []
+    for basisid, component, params, cachename, models in cases:
+        config = getConfig(datadir, component, params,
+                           os.path.join(benchdir, cachename))
+        basis = pyEXP.basis.Basis.factory(config)
+
+        for name, model in models.items():
+            for n in numbers:
+                with MemorySampler() as mem:
+                    best, mean = timeBasis(basis, model, n, nrep, maxarray, chunk, seed)
+
+                # The slowest rank sets the throughput and every rank
+                # holds its own copy of the particles
+                #
+                memory = mem.peak
+                delta  = mem.peak - mem.start
+                if comm is not None:
+                    best   = comm.allreduce(best, op=MPI.MAX)
+                    mean   = comm.allreduce(mean, op=MPI.MAX)
+                    memory = comm.allreduce(memory, op=MPI.MAX)
+                    delta  = comm.allreduce(delta, op=MPI.MAX)
+
+                entry = {'basis'      : basisid,
+                         'params'     : params,
+                         'model'      : name,
+                         'number'     : n,
+                         'method'     : 'createFromArray' if n <= maxarray else 'addFromArray',
+                         'best'       : best,
+                         'mean'       : mean,
+                         'rate'       : n/best,
+                         'peak_MB'    : memory,
+                         'delta_MB'   : delta}
+                results.append(entry)
+
+                if my_rank==0:
+                    print('{:10s} {:24s} {:10s} N={:<10d} {:10.3e} particles/s  peak={:8.1f} MB  delta={:8.1f} MB'.
+                          format(basisid, str(params), name, n, n/best, memory, delta))
+
+    if my_rank==0:
+        info = {'host'       : socket.gethostname(),
+                'date'       : time.strftime('%Y-%m-%d %H:%M:%S'),
+                'omp_threads': os.environ.get('OMP_NUM_THREADS', ''),
+                'mpi_ranks'  : nprocs,
+                'repeat'     : nrep,
+                'seed'       : seed}
+        if 'Version' in dir(pyEXP.util):
+            info['pyEXP'] = '.'.join([str(v) for v in pyEXP.util.Version()])
+
+        with open(output, 'w') as f:
+            json.dump({'info': info, 'results': results}, f, indent=2)
+        print('Wrote', output)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[0], sys.argv[1:]))
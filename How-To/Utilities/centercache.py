@@ -0,0 +1,38 @@
+"""
+The expansion center cache
+
+Expansion centers are kept in a JSON file shared by 'find center
+(parallel).py' and 'make coefficients MPI.py'.  An entry is keyed by
+the identity of the snapshot files (path, size and modification
+time), the reader type and component, and the getDensityCenter
+parameters, so a rewritten snapshot, another component or a different
+stride gets a new center.  Every rank reads the same file, so they all
+agree on which centers need computing.
+"""
+
+import os
+import json
+
+from os.path import exists
+
+
+def centerKey(group, filetype, compname, stride, Nsort):
+    """Make the cache key for a snapshot file group"""
+    parts = []
+    for f in group:
+        st = os.stat(f)
+        parts.append('{}:{}:{}'.format(os.path.abspath(f), st.st_size, st.st_mtime_ns))
+    return '|'.join(parts) + '|type={}|comp={}|stride={}|Nsort={}'.\
+        format(filetype, compname, stride, Nsort)
+
+def readCenterCache(cachefile):
+    """Read the center cache, or start a new one"""
+    if not exists(cachefile): return {}
+    with open(cachefile, 'r') as f:
+        return json.load(f)
+
+def writeCenterCache(cachefile, cache):
+    """Write the center cache so that an interrupted write leaves the old one"""
+    with open(cachefile + '.tmp', 'w') as f:
+        json.dump(cache, f, indent=1)
+    os.replace(cachefile + '.tmp', cachefile)
@@ -8,6 +8,32 @@ import pyEXP
 import numpy as np
 import matplotlib.pyplot as plt
 
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+
+
+def readBlocks(bodyfile, blocksize, skiprows=1, usecols=(1, 2, 3, 4)):
+    """Iterate over a body table in blocks of at most 'blocksize' rows
+
+    The next block is parsed in a background thread while the caller
+    works on the current one, so at most two blocks are in memory at
+    any time.  Each block is returned as a 2d array with the columns
+    in 'usecols'.
+    """
+    def parse(f):
+        lines = list(islice(f, blocksize))
+        if len(lines)==0: return None
+        return np.loadtxt(lines, usecols=usecols, ndmin=2)
+
+    with open(bodyfile, 'r') as f, ThreadPoolExecutor(max_workers=1) as pool:
+        for i in range(skiprows): f.readline()
+        nxt = pool.submit(parse, f)
+        while True:
+            data = nxt.result()
+            if data is None: break
+            nxt = pool.submit(parse, f)
+            yield data
+
 os.chdir('/data/Nbody/NewNbody/new')
 
 # Make the halo basis config
@@ -39,29 +65,26 @@ if not os.path.exists(bodyfile):
           "'psp2ascii -f OUT.run0.00010'")
     exit(1)
 
-data = np.loadtxt(bodyfile, skiprows=1, usecols=(1, 2, 3, 4))
-print(data.shape)
-
-
-# Test partitioning
+# Read and accumulate the table in blocks of 'bunch' rows.  Peak
+# memory is set by the block size rather than by the size of the
+# table, and the parsing of each block overlaps the accumulation of
+# the previous one.
 #
-
-asize = data.shape[0]
-npart = 10
-bunch = int(asize/npart)
+bunch = 1000000
 
 # Setup for coefficient accumulation
 #
 basis.initFromArray()
 
-for i in range(npart+1):
-    ibeg = bunch*i
-    if ibeg<asize:
-        iend = bunch*(i+1)
-        if iend>asize: iend = asize
-        if ibeg < iend:
-            basis.addFromArray(data[ibeg:iend,0], data[ibeg:iend,1:4])
-            print('beg={} end={} [{}]'.format(ibeg, iend, asize))
+asize = 0
+startTime = time.time()
+for data in readBlocks(bodyfile, bunch):
+    basis.addFromArray(data[:,0], data[:,1:4])
+    print('beg={} end={}'.format(asize, asize + data.shape[0]))
+    asize += data.shape[0]
+
+print('Accumulated {} bodies in {:4.2f} seconds'.
+      format(asize, time.time() - startTime))
 
 # Done, get the coefficient structure
 #
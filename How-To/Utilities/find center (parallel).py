@@ -4,6 +4,7 @@ import pyEXP
 from mpi4py import MPI
 
 from os.path import exists
+from centercache import centerKey, readCenterCache, writeCenterCache
 
 #
 # This script estimates the density center set from some phase-space
@@ -29,6 +30,10 @@ if __name__ == "__main__":
     end_seq = 1000
     stride  = 10
     nskip   = 20
+    Nsort   = 1000
+    ctrcache = 'centers.json'         # Center cache shared with the coefficient scripts
+    filetype = 'PSPspl'
+    compname = 'dark'
 
     # Get basic information about the MPI communicator
     #
@@ -75,6 +80,8 @@ if __name__ == "__main__":
     centime = []
     centers = []
 
+    cache = readCenterCache(ctrcache)
+
     for group in batches:
         okay = True
         for f in group:
@@ -91,31 +98,38 @@ if __name__ == "__main__":
         # Make the reader for the desired type.  One could probably try to
         # do this by inspection but that's another project.
         #
-        reader = pyEXP.read.ParticleReader.createReader('PSPspl', group, 0, False);
+        reader = pyEXP.read.ParticleReader.createReader(filetype, group, 0, False);
 
         # Print the type list
         #
         if my_rank==0: print('The component names are:', reader.GetTypes())
 
-        compname = 'dark'
         reader.SelectType(compname)
         if my_rank==0: print('We selected:', compname)
 
         # This computes an expansion center from a mean density
-        # weighted position.  You could compute and cache the center
-        # array . . . or supply it in a different way
-        #
-        startTime = time.time()
-        center = pyEXP.util.getDensityCenter(reader, stride=nskip, Nsort=1000)
-        #                                            ^
-        #                                            |
-        # Choose every nskip particle for sample ----+
-        # This is 10^6 samples for these snaps and nskip=20
+        # weighted position, unless we already have it in the cache
         #
+        key = centerKey(group, filetype, compname, nskip, Nsort)
+        if key in cache:
+            center = cache[key]['center']
+            if my_rank==0: print('Cached center is:', center)
+        else:
+            startTime = time.time()
+            center = pyEXP.util.getDensityCenter(reader, stride=nskip, Nsort=Nsort)
+            #                                            ^
+            #                                            |
+            # Choose every nskip particle for sample ----+
+            # This is 10^6 samples for these snaps and nskip=20
+            #
+            cache[key] = {'time': reader.CurrentTime(), 'center': list(center)}
+            if my_rank==0:
+                print('Created center in {:4.2f} seconds'.
+                      format(time.time() - startTime))
+                print('Center is:', center)
+                writeCenterCache(ctrcache, cache)
+
         if my_rank==0:
-            print('Created center in {:4.2f} seconds'.
-                  format(time.time() - startTime))
-            print('Center is:', center)
             centime.append(reader.CurrentTime())
             centers.append(center)
 
@@ -4,6 +4,7 @@ import pyEXP
 from mpi4py import MPI
 
 from os.path import exists
+from mpitools import fixTime, prefetchGroups, StageTimer
 
 #
 # This script makes an HDF5 coefficient set from some EXP files in
@@ -17,6 +18,19 @@ from os.path import exists
 # where N is the number of processes.  For Slurm allocations, you can
 # leave off "-np N" as usual.
 #
+# Set 'resume = True' below to write each snapshot to the HDF5 file as
+# soon as it is done.  A restarted run then skips every snapshot whose
+# time is already in the file and prints the times that it skips.
+# With the default, 'resume = False', all snapshots are computed and
+# the file is written once at the end.
+#
+
+# Every rank works on every snapshot here, so the snapshots are
+# processed one after another no matter how many nodes you have.  For
+# long snapshot sequences, see 'make coefficients partitioned MPI.py'
+# in 'How-To/Utilities' which gives each rank its own slice of the
+# snapshot list and merges the results in time order.
+#
 
 if __name__ == "__main__":
 
@@ -26,6 +40,10 @@ if __name__ == "__main__":
     beg_seq = 0
     end_seq = 200
     nskip   = 1
+    resume  = False                 # Commit each snapshot and skip those on disk
+    depth   = 1                     # Number of snapshots to read ahead
+    maxread = 8*1024**3             # Maximum bytes of read-ahead at any time
+    tracefile = h5file + '.trace.json'  # Per-stage, per-rank timing trace
 
     # Get basic information about the MPI communicator
     #
@@ -77,17 +95,60 @@ parameters  :
     #
     batches = pyEXP.read.ParticleReader.parseStringList(file_list, '')
 
+    # Only one rank per node needs to read ahead, since the page cache
+    # is shared by all of the ranks on a node
+    #
+    node_comm = world_comm.Split_type(MPI.COMM_TYPE_SHARED)
+    read_ahead = node_comm.Get_rank()==0
+
     # This will contain the coefficient container, need to start will a
     # null instance to trigger construction
     #
     coefs = None
 
+    # Start the stage clock on all ranks together
+    #
+    timer = StageTimer(world_comm)
+
+    # In resume mode, every snapshot is written to the HDF5 file as
+    # soon as its coefficients exist.  On a restart, we read back the
+    # times that are already on disk and skip those snapshots.  Every
+    # rank reads the file so that they all agree on what to skip.
+    #
+    done = set()
+    skipped = []
+    if resume and exists(h5file + '.h5'):
+        done = set([fixTime(t) for t in
+                    pyEXP.coefs.Coefs.factory(h5file + '.h5').Times()])
+        if my_rank==0:
+            print('Found {} times in {}.h5 from a previous run'.
+                  format(len(done), h5file))
+
     # One could replace the above with a read of an existent HDF5
     # coeffficient file and update various stanzas.  For this reason,
     # I am keeping a separate center time and center position list
     # below . . .
 
-    for group in batches:
+    # Drop the snapshots that are already in the file before the
+    # read-ahead sees them, so a restart neither reads their particles
+    # nor pulls them into the page cache.  Making a reader only reads
+    # the snapshot header, which has the time.
+    #
+    if len(done):
+        todo = []
+        for group in batches:
+            if all([exists(f) for f in group]):
+                t = pyEXP.read.ParticleReader.createReader('', group, 0, False).CurrentTime()
+                if fixTime(t) in done:
+                    skipped.append(t)
+                    if my_rank==0:
+                        print('Time {:5.3f} is already in {}.h5, skipping'.
+                              format(t, h5file))
+                    continue
+            todo.append(group)
+        batches = todo
+
+    for group in prefetchGroups(batches, depth, maxread, read_ahead):
         okay = True
         for f in group:
             if not exists(f): okay = False
@@ -103,14 +164,29 @@ parameters  :
         # Make the reader for the desired type.  One could probably try to
         # do this by inspection but that's another project.
         #
-        reader = pyEXP.read.ParticleReader.createReader('', group, 0, False);
+        with timer.stage('createReader', group[0]):
+            reader = pyEXP.read.ParticleReader.createReader('', group, 0, False);
+
+        # Making the reader only reads the header, so the time is
+        # known before SelectType reads the particles.  The pre-pass
+        # above has dropped the done snapshots already; this catches
+        # any left.
+        #
+        if fixTime(reader.CurrentTime()) in done:
+            skipped.append(reader.CurrentTime())
+            if my_rank==0:
+                print('Time {:5.3f} is already in {}.h5, skipping'.
+                      format(reader.CurrentTime(), h5file))
+                print('-'*60)
+            continue
 
         # Print the type list
         #
         if my_rank==0: print('The component names are:', reader.GetTypes())
 
         compname = 'dark'
-        reader.SelectType(compname)
+        with timer.stage('SelectType', group[0]):
+            reader.SelectType(compname)
         if my_rank==0: print('We selected:', compname)
 
         startTime = time.time()
@@ -118,7 +194,8 @@ parameters  :
         # Now compute the coefficients with the default center
         #
         startTime = time.time()
-        coef = halo_basis.createFromReader(reader)
+        with timer.stage('createFromReader', group[0]):
+            coef = halo_basis.createFromReader(reader)
         if my_rank==0:
             print('Created coefficients at Time {:5.3f} for {} particles '
                   'in {:4.2f} seconds'.
@@ -130,18 +207,39 @@ parameters  :
         # anyone?
         #                          This is optional---+
         #                                             |
-        if coefs is None:           #                 v
+        if coefs is None or resume: #                 v
             coefs = pyEXP.coefs.Coefs.makecoefs(coef, compname)
 
-        # Add the coefficients to the container
+        # Add the coefficients to the container.  In resume mode the
+        # container only ever holds this snapshot, so memory stays
+        # flat however long the run is.
         #
-        coefs.add(coef)
+        with timer.stage('add', group[0]):
+            coefs.add(coef)
 
         if my_rank==0:
             print('Added coef to container')
+
+            if resume:
+                with timer.stage('WriteH5Coefs', group[0]):
+                    if exists(h5file + '.h5'):
+                        coefs.ExtendH5Coefs(h5file)
+                    else:
+                        coefs.WriteH5Coefs(h5file)
+                print('Committed Time {:5.3f} to {}.h5'.
+                      format(reader.CurrentTime(), h5file))
+
             print('-'*60)
 
-    if my_rank==0:
+    if my_rank==0 and resume:
+        print('\nCompleted the file group list\n')
+        if len(skipped):
+            print('Skipped {} snapshots already in {}.h5 at times:'.
+                  format(len(skipped), h5file), skipped)
+        print('The coefficients were committed to {}.h5 as we went'.
+              format(h5file))
+
+    if my_rank==0 and not resume:
         print('\nCompleted the file group list\n')
         print('The coefficient time list is', coefs.Times())
 
@@ -149,10 +247,14 @@ parameters  :
         # will be appended. You only want the root process to write
         # the file.
         #
-        if exists(h5file):
-            coefs.ExtendH5Coefs(h5file) # Update an existing HDF5
-            print('Saved the coefficients to an existing HDF5 file')
-        else:
-            coefs.WriteH5Coefs(h5file) # Create a new HDF5
-            print('Saved the coefficients to a new HDF5 file')
+        with timer.stage('WriteH5Coefs', 'all'):
+            if exists(h5file + '.h5'):
+                coefs.ExtendH5Coefs(h5file) # Update an existing HDF5
+                print('Saved the coefficients to an existing HDF5 file')
+            else:
+                coefs.WriteH5Coefs(h5file) # Create a new HDF5
+                print('Saved the coefficients to a new HDF5 file')
 
+    # Gather and write the stage timing from every rank
+    #
+    timer.report(tracefile)
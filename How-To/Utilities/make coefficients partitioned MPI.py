@@ -0,0 +1,294 @@
+import os
+import hashlib
+import time                     # Used for timing the coefficient construction
+import pyEXP
+
+from os.path import exists
+
+#
+# This script makes an HDF5 coefficient set from a long snapshot
+# sequence by dividing the *snapshots* between MPI ranks rather than
+# dividing the particles of every snapshot between all ranks as in
+# 'make coefficients MPI.py' and 'make coefficients native MPI.py'.
+# Use this when you have many more snapshots than you have nodes: the
+# run is then limited by throughput rather than by a serial loop over
+# the snapshot list.
+#
+
+# A note on the design:
+#
+# The pyEXP particle readers and the coefficient accumulation in each
+# basis reduce over MPI_COMM_WORLD whenever MPI has been initialized.
+# That means that a rank can not work on its own snapshot while
+# another rank works on a different one, and we can not split
+# COMM_WORLD into sub-communicators for the C++ side either.  So we
+# prevent mpi4py from initializing MPI on import.  Each rank then runs
+# pyEXP as an independent serial process (using OpenMP threads if your
+# build has them) on its own slice of the snapshot list and writes a
+# partial HDF5 coefficient file.  Once every rank is done, we
+# initialize MPI and rank 0 merges the partial files into a single
+# coefficient container in time order.
+#
+import mpi4py
+mpi4py.rc.initialize = False
+mpi4py.rc.finalize   = False
+from mpi4py import MPI
+
+from mpitools import launcherRank
+
+# Usage:
+#
+# Run command is: "mpirun -np N python3 'make coefficients partitioned MPI.py'"
+# where N is the number of processes.  For Slurm allocations, you can
+# leave off "-np N" as usual.  Each rank is a serial pyEXP process, so
+# you will usually want one rank per node or socket with
+# OMP_NUM_THREADS set to the number of cores per rank.
+#
+
+def launchToken(config):
+    """A token that is the same on every rank of this launch only
+
+    The token hashes the basis config together with the job id of the
+    launcher (Slurm, PMIx, Open MPI or MPICH).  Without a job id, the
+    parent process id is used, which is shared by the ranks that one
+    'mpirun' starts on a single node.
+    """
+    h = hashlib.sha256(config.encode())
+    found = False
+    for v in ['SLURM_JOB_ID', 'SLURM_STEP_ID', 'PMIX_NAMESPACE',
+              'OMPI_MCA_ess_base_jobid', 'PMI_KVSNAME']:
+        if v in os.environ:
+            h.update('{}={}'.format(v, os.environ[v]).encode())
+            found = True
+    if not found:
+        h.update('ppid={}'.format(os.getppid()).encode())
+    return h.hexdigest()
+
+
+def readyMarker(cachefile):
+    """The name of the file that rank 0 writes when the cache is ready"""
+    return cachefile + '.ready'
+
+
+def markReady(cachefile, token):
+    """Write the ready marker for this launch in one step"""
+    marker = readyMarker(cachefile)
+    with open(marker + '.tmp', 'w') as f:
+        f.write(token)
+    os.replace(marker + '.tmp', marker)
+
+
+def waitForCache(cachefile, token, timeout=3600.0, poll=2.0):
+    """Wait until rank 0 has finished writing the basis cache
+
+    Rank 0 removes the marker before it makes the basis and writes it
+    with this launch's token once the cache is complete.  A marker left
+    over from an earlier run has another token, so it is ignored.
+    """
+    marker = readyMarker(cachefile)
+    start  = time.time()
+    while True:
+        if exists(cachefile) and exists(marker):
+            try:
+                with open(marker, 'r') as f:
+                    if f.read() == token: return
+            except OSError:
+                pass
+        if time.time() - start > timeout:
+            raise RuntimeError('Timed out waiting for the basis cache <{}>'.
+                               format(cachefile))
+        time.sleep(poll)
+
+
+if __name__ == "__main__":
+
+    # Parameters
+    #
+    h5file   = 'Run1b_test_coefs'
+    filetype = 'PSPout'             # E.g. 'GadgetHDF5' for Gadget runs
+    prefix   = 'OUT.run1b.{:05d}'   # E.g. 'snapshot_{:04d}.hdf5'
+    compname = 'dark'               # E.g. 'Halo' for Gadget runs
+    beg_seq  = 0
+    end_seq  = 1000
+    nskip    = 0                    # Center stride; 0 means no centering
+    cachename = 'SLGridSph.cache.run1b' # The basis cache shared by all ranks
+
+    # We need the rank and size before MPI is initialized.  Check
+    # that nothing has initialized MPI behind our back, since pyEXP
+    # would then combine the snapshots of all ranks.
+    #
+    my_rank, world_size = launcherRank()
+
+    if MPI.Is_initialized():
+        print('MPI was initialized before the snapshot loop. '
+              'This script needs each rank to run pyEXP serially.')
+        exit(1)
+
+    print("World size is {} and my rank is {}".format(world_size, my_rank))
+
+    # Now switch the working directory where my simulation lives.
+    # Change this to your working directory.
+    #
+    os.chdir('/nas/astro-th/weinberg/Nbody/SimpleHalo')
+
+    # Make the spherical basis config.
+    #
+    halo_config = """
+id          : sphereSL
+parameters  :
+  numr      : 4000
+  rmin      : 0.0001
+  rmax      : 1.95
+  Lmax      : 6
+  nmax      : 20
+  scale     : 0.0667
+  modelname : SLGridSph.model
+  cachename : {}
+""".format(cachename)
+
+    # Construct the basis instance.  Every rank is a separate serial
+    # process here, so nothing stops them all from computing and
+    # writing the same basis cache at once.  So rank 0 goes first and
+    # reads, or makes, the cache; the other ranks wait for the marker
+    # of this launch and then read it.
+    #
+    token = launchToken(halo_config)
+    if my_rank==0:
+        if exists(readyMarker(cachename)): os.remove(readyMarker(cachename))
+        halo_basis = pyEXP.basis.Basis.factory(halo_config)
+        markReady(cachename, token)
+    else:
+        waitForCache(cachename, token)
+        halo_basis = pyEXP.basis.Basis.factory(halo_config)
+
+    # Make the file list for the snapshot sequence.  Change the prefix
+    # above as necessary.
+    #
+    file_list = []
+    for i in range(beg_seq, end_seq):
+        file_list.append(prefix.format(i))
+
+    # Construct batches of files the particle reader.  One could use the
+    # parseStringList to create batches from a vector/list of files.  NB:
+    # a std::vector in C++ becomes a Python.list and vice versa
+    #
+    batches = pyEXP.read.ParticleReader.parseStringList(file_list, '')
+
+    # Skip a file that does not exist in the sequence without going
+    # belly up.  Every rank makes the same list so the partition below
+    # is the same everywhere.
+    #
+    groups = []
+    for group in batches:
+        okay = True
+        for f in group:
+            if not exists(f): okay = False
+        if okay: groups.append(group)
+
+    # Deal the snapshots round robin.  Later snapshots are often
+    # larger, so this balances the load better than contiguous
+    # blocks.  The merge below restores the time order.
+    #
+    my_groups = groups[my_rank::world_size]
+
+    print('Rank {} has {} of {} snapshots'.
+          format(my_rank, len(my_groups), len(groups)))
+
+    # This will contain the coefficient container for my slice
+    #
+    coefs    = None
+    partfile = '{}.part{:04d}'.format(h5file, my_rank)
+
+    runTime = time.time()
+
+    for group in my_groups:
+
+        # Make the reader for the desired type.
+        #
+        reader = pyEXP.read.ParticleReader.createReader(filetype, group, 0, False);
+        reader.SelectType(compname)
+
+        # Use the density center if requested, otherwise the origin
+        #
+        center = [0.0, 0.0, 0.0]
+        if nskip>0:
+            center = pyEXP.util.getDensityCenter(reader, stride=nskip, Nsort=1000)
+
+        startTime = time.time()
+        coef = halo_basis.createFromReader(reader, center)
+        print('[{}] Created coefficients at Time {:5.3f} for {} particles '
+              'in {:4.2f} seconds'.
+              format(my_rank, reader.CurrentTime(), reader.CurrentNumber(),
+                     time.time() - startTime))
+
+        if coefs is None:
+            coefs = pyEXP.coefs.Coefs.makecoefs(coef, compname)
+
+        coefs.add(coef)
+
+    # Save my slice.  A rank may have nothing to do if there are more
+    # ranks than snapshots.
+    #
+    if coefs is not None:
+        if exists(partfile + '.h5'): os.remove(partfile + '.h5')
+        coefs.WriteH5Coefs(partfile)
+    else:
+        partfile = None
+
+    print('Rank {} finished its slice in {:4.2f} seconds'.
+          format(my_rank, time.time() - runTime))
+
+    # Now we can safely bring up MPI and collect the partial file
+    # names on the root process
+    #
+    MPI.Init()
+    world_comm = MPI.COMM_WORLD
+
+    if world_comm.Get_rank() != my_rank or world_comm.Get_size() != world_size:
+        print('Rank {}: the launcher environment does not match COMM_WORLD'.
+              format(my_rank))
+        world_comm.Abort(1)
+
+    parts = world_comm.gather(partfile, root=0)
+
+    if my_rank==0:
+
+        # Read back each partial container and sort the coefficient
+        # structures by time.  We hold on to the containers until the
+        # merged file is written.
+        #
+        slices = []
+        stanza = []
+        for p in parts:
+            if p is None: continue
+            slices.append(pyEXP.coefs.Coefs.factory(p + '.h5'))
+            for t in slices[-1].Times():
+                stanza.append((t, slices[-1].getCoefStruct(t)))
+
+        stanza.sort(key=lambda x: x[0])
+
+        merged = None
+        for t, coef in stanza:
+            if merged is None:
+                merged = pyEXP.coefs.Coefs.makecoefs(coef, compname)
+            merged.add(coef)
+
+        print('\nCompleted the file group list\n')
+        print('The coefficient time list is', merged.Times())
+
+        # You can call the file something convenient.  The suffix 'h5'
+        # will be appended.
+        #
+        if exists(h5file + '.h5'):
+            merged.ExtendH5Coefs(h5file) # Update an existing HDF5
+            print('Saved the coefficients to an existing HDF5 file')
+        else:
+            merged.WriteH5Coefs(h5file) # Create a new HDF5
+            print('Saved the coefficients to a new HDF5 file')
+
+        # Clean up the partial files
+        #
+        for p in parts:
+            if p is not None: os.remove(p + '.h5')
+
+    MPI.Finalize()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+
+"""
+Convert a particle file into a columnar cache for fast reuse
+
+Parsing a large FITS, ascii or Gadget snapshot can take minutes, and
+basis experiments often read the same snapshot over and over.  This
+script does the conversion once.  The cache is a directory holding
+one raw binary file per column (mass, x, y, z) and a small JSON header
+with the particle count, data type, time and source.  Later runs can
+memory map the columns and pass them directly to 'createFromArray'
+or 'addFromArray' without parsing anything, e.g.
+
+   from particlecache import readParticleCache
+
+   mass, pos, header = readParticleCache('GSE.pcache')
+   coef = basis.createFromArray(mass, pos, time=header['time'])
+
+Supported inputs:
+
+   fits   : a FITS binary table with X, Y, Z and optional mass columns
+   ascii  : a 'psp2ascii' body table
+   gadget : one or more Gadget HDF5 snapshot files
+
+EXP PSP files can be cached by running 'psp2ascii' first.
+"""
+
+import os, sys, getopt
+import numpy as np
+
+from itertools import islice
+from particlecache import CacheWriter, readGadget
+
+
+def help(phrase: str) -> None:
+    """Print some usage info"""
+    print(phrase)
+
+
+def cacheFITS(infile, cache, massname=''):
+    """Cache the X, Y, Z columns of a FITS table"""
+    from astropy.io import fits
+
+    with fits.open(infile, memmap=True) as hdul:
+        data = hdul[1].data
+        mass = 1.0
+        if len(massname): mass = data[massname]
+        cache.add(mass, data['X'], data['Y'], data['Z'])
+    return 0.0
+
+
+def cacheAscii(infile, cache, blocksize=1000000):
+    """Cache a psp2ascii table one block of rows at a time"""
+    with open(infile, 'r') as f:
+        f.readline()
+        while True:
+            lines = list(islice(f, blocksize))
+            if len(lines)==0: break
+            data = np.loadtxt(lines, usecols=(1, 2, 3, 4), ndmin=2)
+            cache.add(data[:,0], data[:,1], data[:,2], data[:,3])
+    return 0.0
+
+
+def cacheGadget(infiles, cache, ptype=1):
+    """Cache one particle type from a set of Gadget HDF5 files
+
+    The files of one snapshot share a time; files with no particles of
+    this type are skipped.
+    """
+    time = 0.0
+    for infile in infiles:
+        try:
+            time, pos, mass = readGadget(infile, ptype)
+        except KeyError:
+            continue
+        cache.add(mass, pos[:,0], pos[:,1], pos[:,2])
+    return time
+
+
+def main(prog, argv) -> int:
+    """Make the particle cache"""
+
+    kind     = ''
+    cachedir = ''
+    massname = ''
+    ptype    = 1
+    dtype    = 'float64'
+
+    phrase = prog + ': [-h] -t|--type fits|ascii|gadget -o|--output cachedir [-m|--mass column] [-p|--ptype n] [--float32] files'
+
+    try:
+        opts, args = getopt.getopt(argv, "ht:o:m:p:", ["type=", "output=", "mass=", "ptype=", "float32"])
+    except getopt.GetoptError:
+        help(phrase)
+        return 2
+
+    for opt, arg in opts:
+        if opt == '-h':
+            help(phrase)
+            return 0
+        elif opt in ("-t", "--type"):
+            kind = arg
+        elif opt in ("-o", "--output"):
+            cachedir = arg
+        elif opt in ("-m", "--mass"):
+            massname = arg
+        elif opt in ("-p", "--ptype"):
+            ptype = int(arg)
+        elif opt == "--float32":
+            dtype = 'float32'
+
+    if len(args)==0 or len(cachedir)==0 or kind not in ['fits', 'ascii', 'gadget']:
+        help(phrase)
+        return 1
+
+    for f in args:
+        if not os.path.exists(f):
+            print("File <{}> does not exist".format(f))
+            return 1
+
+    # pyEXP works in double precision, so the default float64 columns
+    # are handed to the basis without a conversion
+    #
+    cache = CacheWriter(cachedir, dtype)
+
+    if kind == 'fits':
+        time = cacheFITS(args[0], cache, massname)
+    elif kind == 'ascii':
+        time = cacheAscii(args[0], cache)
+    else:
+        time = cacheGadget(args, cache, ptype)
+
+    cache.close(time, ' '.join(args))
+    print("Cached {} particles in <{}>".format(cache.nbody, cachedir))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[0], sys.argv[1:]))
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+
+"""
+Make or update a manifest of the snapshots in a run directory
+
+The drivers in this directory build their file lists from a fixed
+range of snapshot indices and check every name with 'exists'.  On a
+network file system that can take a long time for a long run.  This
+script scans the directory once and writes a JSON index with, for
+each snapshot:
+
+   index  : the snapshot index parsed from the file name
+   files  : the file names of all parts of the snapshot
+   size   : the size of each part in bytes
+   mtime  : the modification time of each part
+   time   : the simulation time
+   number : the number of particles in each component
+
+Running the script again only opens new or changed snapshots.  The
+snapshot entries are in index order, so a driver can use the 'files'
+lists directly as its batches, e.g.
+
+   with open('SPL.run010.manifest') as f:
+       batches = [s['files'] for s in json.load(f)['snapshots']]
+
+Missing indices (e.g. after a Gadget restart) are listed in 'gaps'.
+"""
+
+import os, sys, re, getopt, json
+import pyEXP
+
+
+def help(phrase: str) -> None:
+    """Print some usage info"""
+    print(phrase)
+
+
+def scanDirectory(dir, prefix, suffix):
+    """Group the snapshot files in a directory by snapshot index
+
+    File names are 'prefix' + index + an optional part number
+    separated by '_' or '.' + 'suffix'.  Returns a dictionary of index
+    to a list of (part, name, size, mtime) tuples.
+    """
+    pattern = re.compile('^' + re.escape(prefix) + r'(\d+)(?:[._](\d+))?' +
+                         re.escape(suffix) + '$')
+    groups = {}
+    with os.scandir(dir) as it:
+        for entry in it:
+            m = pattern.match(entry.name)
+            if m is None or not entry.is_file(): continue
+            st = entry.stat()
+            part = int(m.group(2)) if m.group(2) is not None else 0
+            groups.setdefault(int(m.group(1)), []).append(
+                (part, entry.name, st.st_size, st.st_mtime))
+    for index in groups: groups[index].sort()
+    return groups
+
+
+def readSnapshot(filetype, files):
+    """Open a snapshot with pyEXP and get its time and particle counts"""
+    reader = pyEXP.read.ParticleReader.createReader(filetype, files, 0, False)
+    number = {}
+    for name in reader.GetTypes():
+        reader.SelectType(name)
+        number[name] = reader.CurrentNumber()
+    return reader.CurrentTime(), number
+
+
+def main(prog, argv) -> int:
+    """Make or update the manifest"""
+
+    dir      = '.'
+    filetype = 'PSPspl'
+    suffix   = ''
+    output   = ''
+
+    phrase = prog + ': [-h] [-d|--dir run_directory] [-t|--type reader_type] [-s|--suffix suffix] [-o|--output manifest] prefix'
+
+    try:
+        opts, args = getopt.getopt(argv, "hd:t:s:o:", ["dir=", "type=", "suffix=", "output="])
+    except getopt.GetoptError:
+        help(phrase)
+        return 2
+
+    for opt, arg in opts:
+        if opt == '-h':
+            help(phrase)
+            return 0
+        elif opt in ("-d", "--dir"):
+            dir = arg
+        elif opt in ("-t", "--type"):
+            filetype = arg
+        elif opt in ("-s", "--suffix"):
+            suffix = arg
+        elif opt in ("-o", "--output"):
+            output = arg
+
+    if len(args) != 1:
+        help(phrase)
+        return 1
+
+    prefix = args[0]
+    if len(output)==0: output = prefix.rstrip('._') + '.manifest'
+
+    os.chdir(dir)
+
+    # Reuse the entries from a previous scan when none of the parts
+    # have changed
+    #
+    old = {}
+    if os.path.exists(output):
+        with open(output, 'r') as f:
+            db = json.load(f)
+        if db['type'] == filetype:
+            for s in db['snapshots']: old[s['index']] = s
+
+    groups = scanDirectory('.', prefix, suffix)
+
+    snapshots = []
+    nread = 0
+    for index in sorted(groups):
+        files = [g[1] for g in groups[index]]
+        size  = [g[2] for g in groups[index]]
+        mtime = [g[3] for g in groups[index]]
+
+        s = old.get(index)
+        if s is None or s['files'] != files or s['size'] != size or s['mtime'] != mtime:
+            time, number = readSnapshot(filetype, files)
+            s = {'index': index, 'files': files, 'size': size, 'mtime': mtime,
+                 'time': time, 'number': number}
+            nread += 1
+
+        snapshots.append(s)
+
+    # Record the holes in the index sequence
+    #
+    gaps = []
+    for a, b in zip(snapshots[:-1], snapshots[1:]):
+        gaps.extend(range(a['index']+1, b['index']))
+
+    db = {'type': filetype, 'prefix': prefix, 'suffix': suffix,
+          'snapshots': snapshots, 'gaps': gaps}
+
+    with open(output + '.tmp', 'w') as f:
+        json.dump(db, f, separators=(',', ':'))
+    os.replace(output + '.tmp', output)
+
+    print("Wrote <{}>: {} snapshots, {} read, {} gaps".
+          format(output, len(snapshots), nread, len(gaps)))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[0], sys.argv[1:]))
@@ -0,0 +1,187 @@
+"""
+Helpers shared by the MPI coefficient scripts
+
+'make coefficients MPI.py' and 'make coefficients native MPI.py' in
+this directory and 'make coefficients using MPI.py' in Recipes/Gadget
+all loop over a snapshot list with every rank working on every
+snapshot.  This module has the pieces of that loop that do not depend
+on the snapshot format:
+
+   fixTime        : a fixed-point time for comparing snapshot times
+   prefetchGroups : read the next snapshots into the page cache
+   StageTimer     : per-stage, per-rank timing and a Chrome trace
+
+The scripts that deal the snapshots out between ranks and only bring
+up MPI at the end ('make coefficients partitioned MPI.py' and the MPI
+histogram recipe) also use
+
+   launcherRank   : the rank and size before MPI is initialized
+"""
+
+import os
+import time
+import json
+import queue
+import threading
+
+from os.path import exists
+from contextlib import contextmanager
+
+
+# For making a unique fixed-point time for comparing snapshot times
+# with the times already in the coefficient file
+#
+def fixTime(time):
+    fixedD = 100000.0;
+    return int(fixedD*time+0.5)/fixedD
+
+# Read ahead in the snapshot list.  Opening a snapshot is I/O bound
+# and making coefficients is compute bound, so while the basis works
+# on snapshot k we read the files for snapshot k+1 (up to 'depth'
+# snapshots ahead) in a background thread.  The data is discarded:
+# the point is to get it into the operating system's page cache so
+# that the pyEXP reader finds it there.  The reader and the basis are
+# untouched, so the coefficients are identical to the serial loop.
+# At most 'maxbytes' of read-ahead data are outstanding at any time.
+# The worker may finish one more group than 'depth' while it waits for
+# a free slot, so the read-ahead is up to depth+1 snapshots.  An error
+# in the worker (e.g. a file that vanishes) is raised in the loop.
+#
+def prefetchGroups(batches, depth=1, maxbytes=8*1024**3, warm=True,
+                   blocksize=64*1024**2):
+    """Iterate over the file groups, reading ahead in the background"""
+
+    if not warm or depth<1:
+        for group in batches: yield group
+        return
+
+    todo   = queue.Queue(maxsize=depth)
+    cond   = threading.Condition()
+    budget = [maxbytes]
+
+    def worker():
+        try:
+            buf = bytearray(blocksize)
+            for group in batches:
+                size = sum([os.path.getsize(f) for f in group if exists(f)])
+                size = min(size, maxbytes)
+                with cond:
+                    cond.wait_for(lambda: budget[0] >= size)
+                    budget[0] -= size
+                for f in group:
+                    if not exists(f): continue
+                    with open(f, 'rb', buffering=0) as fp:
+                        while fp.readinto(buf) > 0: pass
+                todo.put((group, size))
+        except BaseException as e:
+            todo.put(e)
+        todo.put(None)
+
+    thread = threading.Thread(target=worker, daemon=True)
+    thread.start()
+
+    while True:
+        item = todo.get()
+        if item is None: break
+        if isinstance(item, BaseException): raise item
+        yield item[0]
+        with cond:
+            budget[0] += item[1]
+            cond.notify()
+
+# Per-stage timing for every snapshot on every rank.  Each stage of
+# the pipeline is wrapped in 'with timer.stage(name, snapshot):'.  At
+# the end, the records from all ranks are gathered to the root, which
+# writes a Chrome trace file (open it at https://ui.perfetto.dev or
+# chrome://tracing) with one track per rank and prints a summary.
+# Load imbalance, a slow node or a stalled HDF5 write shows up there.
+#
+class StageTimer:
+    """Collect start and stop times of the pipeline stages on this rank"""
+
+    def __init__(self, comm):
+        self.comm = comm
+        self.records = []
+        comm.Barrier()
+        self.t0 = time.time()
+
+    @contextmanager
+    def stage(self, name, snapshot):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.records.append((name, snapshot, start - self.t0,
+                                 time.time() - self.t0))
+
+    def report(self, tracefile):
+        """Gather the records to the root, write the trace and print a summary"""
+        ranks = self.comm.gather(self.records, root=0)
+        if self.comm.Get_rank() != 0: return
+
+        events = []
+        for rank, records in enumerate(ranks):
+            events.append({'name': 'process_name', 'ph': 'M', 'pid': rank,
+                           'args': {'name': 'rank {}'.format(rank)}})
+            for name, snapshot, start, stop in records:
+                events.append({'name': name, 'cat': 'snapshot', 'ph': 'X',
+                               'pid': rank, 'tid': 0,
+                               'ts': 1.0e6*start, 'dur': 1.0e6*(stop - start),
+                               'args': {'snapshot': snapshot}})
+
+        with open(tracefile, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+        # Total time per stage on each rank.  The imbalance is the
+        # slowest rank's total over the mean total.
+        #
+        stages = []
+        totals = {}
+        counts = {}
+        for rank, records in enumerate(ranks):
+            for name, snapshot, start, stop in records:
+                if name not in totals:
+                    stages.append(name)
+                    totals[name] = [0.0]*len(ranks)
+                    counts[name] = [0]*len(ranks)
+                totals[name][rank] += stop - start
+                counts[name][rank] += 1
+
+        # Some stages only run on some ranks (e.g. the root writes the
+        # HDF5 file).  Their imbalance would only measure that, so we
+        # average over the ranks that ran the stage and name them.
+        #
+        print('\nTiming summary written to {}\n'.format(tracefile))
+        print('{:20s} {:>6s} {:>10s} {:>10s} {:>10s}'.
+              format('Stage', 'Count', 'Mean[s]', 'Max[s]', 'Imbalance'))
+        print('-'*60)
+        for name in stages:
+            which = [r for r in range(len(ranks)) if counts[name][r]>0]
+            count = max(counts[name])
+            mean  = sum(totals[name])/len(which)
+            peak  = max(totals[name])
+            if len(which) == len(ranks):
+                print('{:20s} {:6d} {:10.3f} {:10.3f} {:10.2f}'.
+                      format(name, count, mean, peak, peak/mean if mean>0 else 1.0))
+            elif len(which) == 1:
+                print('{:20s} {:6d} {:10.3f} {:10.3f} {:>10s}  (rank {} only)'.
+                      format(name, count, mean, peak, '-', which[0]))
+            else:
+                print('{:20s} {:6d} {:10.3f} {:10.3f} {:>10s}  ({} of {} ranks)'.
+                      format(name, count, mean, peak, '-', len(which), len(ranks)))
+
+
+def launcherRank():
+    """Get the rank and size from the MPI launcher environment
+
+    For scripts that only initialize MPI at the end, we ask the
+    launcher rather than the communicator.  Open MPI, MPICH/Intel MPI,
+    MVAPICH and Slurm 'srun' are checked in that order.
+    """
+    for r, s in [('OMPI_COMM_WORLD_RANK', 'OMPI_COMM_WORLD_SIZE'),
+                 ('PMI_RANK',             'PMI_SIZE'            ),
+                 ('MV2_COMM_WORLD_RANK',  'MV2_COMM_WORLD_SIZE' ),
+                 ('SLURM_PROCID',         'SLURM_NTASKS'        )]:
+        if r in os.environ and s in os.environ:
+            return int(os.environ[r]), int(os.environ[s])
+    return 0, 1
@@ -0,0 +1,101 @@
+"""
+Read and write the columnar particle caches
+
+A cache is a directory holding one raw binary file per column (mass,
+x, y, z) and a small JSON header with the particle count, data type,
+time and source.  'make particle cache.py' in this directory makes
+them from FITS, ascii or Gadget files; any script can memory map one
+with
+
+   from particlecache import readParticleCache
+
+   mass, pos, header = readParticleCache('GSE.pcache')
+
+and pass the columns straight to 'createFromArray' or 'addFromArray'.
+
+'readGadget' reads one particle type from a Gadget HDF5 snapshot into
+arrays for the recipes that work on arrays rather than a particle
+reader.
+"""
+
+import os, json
+import numpy as np
+
+columns = ['mass', 'x', 'y', 'z']
+
+
+def readParticleCache(cachedir):
+    """Memory map a particle cache
+
+    Returns the mass array, the list of [x, y, z] arrays and the
+    header dictionary.  The arrays are read-only views of the files on
+    disk so nothing is read until it is used.
+    """
+    with open(os.path.join(cachedir, 'header.json'), 'r') as f:
+        header = json.load(f)
+
+    data = {}
+    for c in columns:
+        data[c] = np.memmap(os.path.join(cachedir, c + '.dat'),
+                            dtype=header['dtype'], mode='r',
+                            shape=(header['nbody'],))
+
+    return data['mass'], [data['x'], data['y'], data['z']], header
+
+
+class CacheWriter:
+    """Append blocks of particles to the column files of a cache"""
+
+    def __init__(self, cachedir, dtype='float64'):
+        os.makedirs(cachedir, exist_ok=True)
+        self.cachedir = cachedir
+        self.dtype    = np.dtype(dtype)
+        self.nbody    = 0
+        self.files    = {}
+        for c in columns:
+            self.files[c] = open(os.path.join(cachedir, c + '.dat'), 'wb')
+
+    def add(self, mass, x, y, z):
+        """Append one block; mass may be a scalar for equal masses"""
+        n = len(x)
+        mass = np.broadcast_to(np.asarray(mass, dtype=self.dtype), (n,))
+        for c, v in zip(columns, [mass, x, y, z]):
+            np.ascontiguousarray(v, dtype=self.dtype).tofile(self.files[c])
+        self.nbody += n
+
+    def close(self, time=0.0, source=''):
+        """Close the column files and write the header"""
+        for c in columns: self.files[c].close()
+        header = {'nbody'   : self.nbody,
+                  'dtype'   : self.dtype.name,
+                  'columns' : columns,
+                  'time'    : float(time),
+                  'source'  : source}
+        with open(os.path.join(self.cachedir, 'header.json'), 'w') as f:
+            json.dump(header, f, indent=2)
+
+
+def readGadget(snapfile, ptype, velocities=False):
+    """Read the time, positions and masses of one Gadget particle type
+
+    Returns (time, pos, mass) with pos an (N, 3) array.  The mass is a
+    scalar when the snapshot uses the header mass table.  With
+    velocities=True, the (N, 3) velocities are returned as a fourth
+    item.  A KeyError is raised if the snapshot has no particles of
+    that type.
+    """
+    import h5py
+
+    with h5py.File(snapfile, 'r') as f:
+        time  = f['Header'].attrs['Time']
+        group = 'PartType{}'.format(ptype)
+        if group not in f:
+            raise KeyError('{} has no {}'.format(snapfile, group))
+        pos = f[group]['Coordinates'][:]
+        if 'Masses' in f[group]:
+            mass = f[group]['Masses'][:]
+        else:
+            mass = f['Header'].attrs['MassTable'][ptype]
+        if velocities:
+            return time, pos, mass, f[group]['Velocities'][:]
+    return time, pos, mass